@@ -0,0 +1,52 @@
+'use strict'
+
+// Commit subjects start with the request they implement, e.g.
+// "[user-001] feat: add ...", so the conventional type is parsed after that
+// tag. Otherwise this follows the angular preset the action uses by default.
+const parserOpts = {
+  headerPattern: /^(?:\[[\w-]+\] )?(\w*)(?:\((.*)\))?: (.*)$/,
+  headerCorrespondence: ['type', 'scope', 'subject'],
+  noteKeywords: ['BREAKING CHANGE'],
+  revertPattern: /^(?:Revert|revert:)\s"?([\s\S]+?)"?\s*This reverts commit (\w*)\./i,
+  revertCorrespondence: ['header', 'hash'],
+}
+
+const sections = {
+  feat: 'Features',
+  fix: 'Bug Fixes',
+  perf: 'Performance Improvements',
+  revert: 'Reverts',
+}
+
+module.exports = {
+  parserOpts,
+  recommendedBumpOpts: {
+    parserOpts,
+    whatBump: (commits) => {
+      const breaking = commits.filter((commit) => commit.notes.length > 0).length
+      const features = commits.filter((commit) => commit.type === 'feat').length
+      return {
+        level: breaking > 0 ? 0 : features > 0 ? 1 : 2,
+        reason: `There are ${breaking} BREAKING CHANGES and ${features} features`,
+      }
+    },
+  },
+  writerOpts: {
+    transform: (commit) => {
+      const section = sections[commit.type]
+      if (!section && commit.notes.length === 0) {
+        return undefined
+      }
+      return {
+        ...commit,
+        type: section || commit.type,
+        header: commit.scope ? `**${commit.scope}:** ${commit.subject}` : commit.subject,
+        shortHash: commit.hash.substring(0, 7),
+      }
+    },
+    groupBy: 'type',
+    commitGroupsSort: 'title',
+    commitsSort: ['scope', 'subject'],
+    noteGroupsSort: 'title',
+  },
+}
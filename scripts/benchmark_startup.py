@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""Measure how quickly manage_dotfiles starts for non-interactive commands.
+
+Every command runs several times against a throwaway repository and home
+directory through the real entry point, ``scripts/manage_dotfiles.py``
+executed by path as shell hooks do. The budget is on the median wall time of
+each over the floor no command can beat: the interpreter starting and
+importing the standard library modules every command needs. That floor is
+measured on the machine itself, since on slow machines it alone takes over
+45ms; ``--budget-ms`` adds an absolute limit on top.
+``python -X importtime`` then shows what importing the manager costs and which
+modules dominate, and modules only some commands need are checked to stay
+unloaded. Exits with status 1 if any command goes over the budget or such a
+module is loaded.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+MANAGER = SCRIPT_DIR / "manage_dotfiles.py"
+
+# Modules only the interactive menus or specific commands should load
+LAZY_MODULES = [
+    "inquirer",
+    "blessed",
+    "readchar",
+    "concurrent.futures",
+    "tarfile",
+    "dotfiles_profiles",
+    "hashlib",
+    "datetime",
+]
+
+# Standard library modules every command needs, the floor for startup
+STDLIB_IMPORTS = "import argparse, json, pathlib, shutil"
+
+
+def run(args, env, cwd=None):
+    start = time.perf_counter()
+    subprocess.run(
+        args,
+        env=env,
+        cwd=cwd,
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return time.perf_counter() - start
+
+
+def median_time(args, env, runs):
+    return statistics.median(run(args, env) for _ in range(runs))
+
+
+def import_times(env):
+    """Import the manager with -X importtime and parse the report.
+
+    Returns:
+        dict: Cumulative import time in microseconds per module
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import manage_dotfiles"],
+        env=env,
+        cwd=SCRIPT_DIR,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def setup_repo(root):
+    home = root / "home"
+    repo = root / "repo"
+    (home / ".config" / "app").mkdir(parents=True)
+    repo.mkdir()
+    (home / ".bashrc").write_text("export EDITOR=nvim\n")
+    (home / ".config" / "app" / "config.toml").write_text("theme = 'dark'\n")
+
+    env = dict(os.environ, HOME=str(home))
+    # Startup is measured with the bytecode cache a normal install has
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    subprocess.run(
+        [str(MANAGER), "--repo", str(repo), "add"]
+        + [str(home / ".bashrc"), str(home / ".config" / "app")],
+        env=env,
+        check=True,
+        stdout=subprocess.DEVNULL,
+    )
+    return repo, env
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=15, help="Runs per command")
+    parser.add_argument(
+        "--overhead-ms",
+        type=float,
+        default=25.0,
+        help="Maximum median wall time per command over the standard library "
+        "import floor, in milliseconds",
+    )
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        help="Also fail if a command's median wall time exceeds this, in milliseconds",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="dotfiles-startup-") as tmp:
+        repo, env = setup_repo(Path(tmp))
+        base = [str(MANAGER), "--repo", str(repo)]
+        commands = {
+            "list": ["list"],
+            "list --json": ["list", "--json"],
+            "backup .bashrc --jsonl": ["backup", ".bashrc", "--jsonl"],
+            "restore .bashrc --jsonl": ["restore", ".bashrc", "--jsonl"],
+            "restore --all --dry-run": ["restore", "--all", "--dry-run"],
+            "doctor": ["doctor"],
+        }
+
+        interpreter = median_time([sys.executable, "-c", "pass"], env, args.runs)
+        stdlib = median_time([sys.executable, "-c", STDLIB_IMPORTS], env, args.runs)
+        print(f"Bare interpreter start: {interpreter * 1000:.1f}ms (median)")
+        print(
+            f"Interpreter importing {STDLIB_IMPORTS[len('import '):]}: "
+            f"{stdlib * 1000:.1f}ms\n"
+        )
+        budget = stdlib * 1000 + args.overhead_ms
+        if args.budget_ms is not None:
+            budget = min(budget, args.budget_ms)
+        print(f"{'command':<26} {'median':>9} {'over floor':>11}")
+
+        over_budget = []
+        for name, command in commands.items():
+            elapsed = median_time(base + command, env, args.runs) * 1000
+            overhead = elapsed - stdlib * 1000
+            print(f"{name:<26} {elapsed:>7.1f}ms {overhead:>9.1f}ms")
+            if elapsed > budget:
+                over_budget.append(name)
+
+        times = import_times(env)
+        print(
+            f"\nImporting manage_dotfiles: {times['manage_dotfiles'] / 1000:.1f}ms "
+            "(-X importtime, cumulative)"
+        )
+        print("Slowest imports:")
+        slowest = sorted(
+            (item for item in times.items() if item[0] != "manage_dotfiles"),
+            key=lambda item: item[1],
+            reverse=True,
+        )
+        for module, micros in slowest[:8]:
+            print(f"  {module:<24} {micros / 1000:>6.1f}ms")
+
+        loaded = [module for module in LAZY_MODULES if module in times]
+        if loaded:
+            print(f"\nLoaded at startup but should be lazy: {', '.join(loaded)}")
+
+    if over_budget:
+        print(f"\nOver the {budget:.1f}ms budget: {', '.join(over_budget)}")
+    if over_budget or loaded:
+        return 1
+    print(f"\nAll commands finish within {budget:.1f}ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
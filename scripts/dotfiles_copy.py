@@ -0,0 +1,140 @@
+"""Copy-on-write aware file copying for backups.
+
+``fast_copy`` first tries to reflink the file (``FICLONE``, supported by btrfs,
+XFS and others), which shares the data blocks and finishes instantly. Where
+that isn't possible it lets the kernel copy the data with
+``os.copy_file_range`` or ``os.sendfile`` instead of pumping it through user
+space. ``link_copy`` hardlinks instead: the copy shares its inode with the
+source, so it is only a snapshot for files that are replaced rather than
+modified in place.
+"""
+
+import errno
+import fcntl
+import os
+import shutil
+
+FICLONE = 0x40049409
+COPY_MODES = ["auto", "hardlink", "copy"]
+
+# Errors that mean "this method isn't available here", not a real I/O failure
+_UNSUPPORTED = {
+    errno.EXDEV,
+    errno.ENOSYS,
+    errno.EINVAL,
+    errno.EOPNOTSUPP,
+    errno.ENOTTY,
+    errno.EBADF,
+    errno.EPERM,
+}
+
+# (source device, destination device) pairs for which reflinks or
+# copy_file_range already failed once; both can work within a device but not
+# across devices
+_no_reflink = set()
+_no_copy_range = set()
+
+
+def _copy_range(src_fd, dst_fd, size):
+    copied = 0
+    while copied < size:
+        n = os.copy_file_range(src_fd, dst_fd, size - copied)
+        if n == 0:
+            break
+        copied += n
+    return copied
+
+
+def _sendfile(src_fd, dst_fd, size):
+    copied = 0
+    while copied < size:
+        n = os.sendfile(dst_fd, src_fd, copied, size - copied)
+        if n == 0:
+            break
+        copied += n
+    return copied
+
+
+def copy_fd(src_fd, dst_fd):
+    """Copy all data between two open files with the cheapest available method.
+
+    Returns:
+        str: The method used ("reflink", "copy_file_range", "sendfile" or "read")
+    """
+    src_stat = os.fstat(src_fd)
+    size = src_stat.st_size
+    devices = (src_stat.st_dev, os.fstat(dst_fd).st_dev)
+
+    if devices not in _no_reflink:
+        try:
+            fcntl.ioctl(dst_fd, FICLONE, src_fd)
+            return "reflink"
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED:
+                raise
+            _no_reflink.add(devices)
+
+    if devices not in _no_copy_range and hasattr(os, "copy_file_range"):
+        try:
+            if _copy_range(src_fd, dst_fd, size) == size:
+                return "copy_file_range"
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED:
+                raise
+            _no_copy_range.add(devices)
+        os.lseek(src_fd, 0, os.SEEK_SET)
+        os.lseek(dst_fd, 0, os.SEEK_SET)
+        os.ftruncate(dst_fd, 0)
+
+    try:
+        if _sendfile(src_fd, dst_fd, size) == size:
+            return "sendfile"
+    except OSError as e:
+        if e.errno not in _UNSUPPORTED:
+            raise
+    os.lseek(src_fd, 0, os.SEEK_SET)
+    os.lseek(dst_fd, 0, os.SEEK_SET)
+    os.ftruncate(dst_fd, 0)
+    with (
+        os.fdopen(os.dup(src_fd), "rb") as fsrc,
+        os.fdopen(os.dup(dst_fd), "wb") as fdst,
+    ):
+        shutil.copyfileobj(fsrc, fdst)
+    return "read"
+
+
+def fast_copy_data(src, dst):
+    """Copy only the contents of ``src`` to ``dst`` (like ``shutil.copyfile``)."""
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        copy_fd(fsrc.fileno(), fdst.fileno())
+    return dst
+
+
+def fast_copy(src, dst, *, follow_symlinks=True):
+    """Drop-in replacement for ``shutil.copy2`` that reflinks when it can."""
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    if not follow_symlinks and os.path.islink(src):
+        os.symlink(os.readlink(src), dst)
+        return dst
+    fast_copy_data(src, dst)
+    shutil.copystat(src, dst, follow_symlinks=follow_symlinks)
+    return dst
+
+
+def link_copy(src, dst, *, follow_symlinks=True):
+    """Hardlink ``src`` to ``dst``, falling back to ``fast_copy`` across devices.
+
+    Every file is linked, changed or not, so writing to ``src`` in place also
+    changes ``dst``.
+    """
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    try:
+        os.link(src, dst, follow_symlinks=follow_symlinks)
+        return dst
+    except OSError:
+        return fast_copy(src, dst, follow_symlinks=follow_symlinks)
+
+
+COPY_FUNCTIONS = {"auto": fast_copy, "hardlink": link_copy, "copy": shutil.copy2}
@@ -0,0 +1,152 @@
+"""Compare two snapshots of a config: backups of any format or live files.
+
+Files are matched by path and compared as cheaply as possible: the same inode
+or a different size settles it without reading anything, and otherwise the
+content hashes are compared (dedup manifests already store them). Only files
+whose contents differ are read again to produce a line diff, and results are
+yielded one path at a time so output can be streamed.
+"""
+
+import difflib
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from dotfiles_store import (
+    archive_format,
+    entry_path,
+    extract_archive,
+    hash_file,
+    is_manifest,
+)
+
+# Bytes inspected to decide whether a file is text
+TEXT_SNIFF_SIZE = 8192
+
+
+class Snapshot:
+    """A backup or live tree loaded for comparison.
+
+    Archives are unpacked into a temporary directory, so use the snapshot as
+    a context manager to clean that up again.
+    """
+
+    def __init__(self, path, store):
+        self.path = Path(path)
+        self.store = store
+        self.root = None
+        self.device = None
+        self._tmp = None
+
+        if is_manifest(self.path):
+            entries = store.read_manifest(self.path)["entries"]
+        else:
+            self.root = self.path
+            if archive_format(self.path):
+                self._tmp = Path(tempfile.mkdtemp(prefix="dotfiles-diff-"))
+                self.root = extract_archive(self.path, self._tmp / "root")
+            else:
+                self.device = os.lstat(self.root).st_dev
+            entries = store.scan(self.root)
+        self.entries = {entry["path"]: entry for entry in entries}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._tmp is not None:
+            shutil.rmtree(self._tmp, ignore_errors=True)
+            self._tmp = None
+
+    def file_path(self, entry):
+        """Get the on-disk location holding a file entry's contents."""
+        if self.root is None:
+            return self.store.object_path(entry["hash"])
+        return entry_path(self.root, entry["path"])
+
+    def digest(self, entry):
+        if entry.get("hash") is None:
+            entry["hash"] = hash_file(self.file_path(entry))
+        return entry["hash"]
+
+    def read(self, entry):
+        with open(self.file_path(entry), "rb") as f:
+            return f.read()
+
+
+def same_contents(old, new, old_entry, new_entry):
+    """Check whether two file entries hold the same data, hashing only if needed."""
+    if old_entry["size"] != new_entry["size"]:
+        return False
+    if (
+        old.device is not None
+        and old.device == new.device
+        and old_entry["ino"] == new_entry["ino"]
+    ):
+        return True
+    return old.digest(old_entry) == new.digest(new_entry)
+
+
+def _decode_text(data):
+    if b"\0" in data[:TEXT_SNIFF_SIZE]:
+        return None
+    try:
+        return data.decode("utf-8")
+    except UnicodeDecodeError:
+        return None
+
+
+def line_diff(old, new, old_entry, new_entry, old_label, new_label):
+    """Yield unified diff lines for a changed file, or a note for binary files."""
+    old_text = _decode_text(old.read(old_entry))
+    new_text = _decode_text(new.read(new_entry))
+    if old_text is None or new_text is None:
+        yield f"Binary files {old_label} and {new_label} differ"
+        return
+    yield from difflib.unified_diff(
+        old_text.splitlines(),
+        new_text.splitlines(),
+        fromfile=old_label,
+        tofile=new_label,
+        lineterm="",
+    )
+
+
+def diff_snapshots(old, new, name):
+    """Compare two snapshots path by path.
+
+    Args:
+        old (Snapshot): The snapshot to compare against
+        new (Snapshot): The snapshot whose changes are reported
+        name (str): Config name the paths are reported under
+
+    Yields:
+        tuple: (status, path, lines) for every path that differs, where status
+        is "added", "removed", "modified" or "type", and ``lines`` is an
+        iterator over the diff lines of modified text files (empty otherwise)
+    """
+    for relative in sorted(old.entries.keys() | new.entries.keys()):
+        path = name if relative == "." else f"{name}/{relative}"
+        old_entry = old.entries.get(relative)
+        new_entry = new.entries.get(relative)
+
+        if old_entry is None or new_entry is None:
+            entry = old_entry or new_entry
+            if entry["type"] != "dir":
+                yield ("added" if old_entry is None else "removed"), path, iter(())
+        elif old_entry["type"] != new_entry["type"]:
+            yield "type", path, iter(())
+        elif old_entry["type"] == "symlink":
+            if old_entry["target"] != new_entry["target"]:
+                yield "modified", path, iter(
+                    [f"-{old_entry['target']}", f"+{new_entry['target']}"]
+                )
+        elif old_entry["type"] == "file":
+            if not same_contents(old, new, old_entry, new_entry):
+                yield "modified", path, line_diff(
+                    old, new, old_entry, new_entry, f"a/{path}", f"b/{path}"
+                )
@@ -0,0 +1,206 @@
+"""``.dotfilesignore`` rules with gitignore semantics.
+
+Patterns match paths relative to the home directory (which is the same as
+relative to ``dotfiles/``). All rules are compiled into a single regular
+expression per entry kind, with the alternatives in reverse order so the first
+alternative that matches is the last rule that applies, as in gitignore. The
+walkers that use a matcher skip excluded directories entirely, so files below
+them can't be re-included, again matching git.
+"""
+
+import os
+import re
+from pathlib import Path
+
+IGNORE_FILE = ".dotfilesignore"
+
+
+def _translate(pattern):
+    """Translate a gitignore glob (without ``!`` or trailing ``/``) to a regex."""
+    anchored = "/" in pattern
+    pattern = pattern.lstrip("/")
+    regex = "" if anchored else "(?:.*/)?"
+
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i) and (i == 0 or pattern[i - 1] == "/"):
+            regex += "(?:.*/)?"
+            i += 3
+        elif (
+            pattern.startswith("**", i)
+            and i + 2 == len(pattern)
+            and (i == 0 or pattern[i - 1] == "/")
+        ):
+            regex += ".*"
+            i += 2
+        elif pattern[i] == "*":
+            regex += "[^/]*"
+            i += 1
+        elif pattern[i] == "?":
+            regex += "[^/]"
+            i += 1
+        elif pattern[i] == "[":
+            start = i + 1
+            if pattern[start : start + 1] in ("!", "^"):
+                start += 1
+            if pattern[start : start + 1] == "]":
+                start += 1
+            end = pattern.find("]", start)
+            if end == -1:
+                regex += re.escape("[")
+                i += 1
+                continue
+            body = pattern[i + 1 : end]
+            if body[0] in "!^":
+                body = "^" + body[1:]
+            regex += "(?!/)[" + body.replace("\\", "\\\\") + "]"
+            i = end + 1
+        elif pattern[i] == "\\" and i + 1 < len(pattern):
+            regex += re.escape(pattern[i + 1])
+            i += 2
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+    # A matching directory also excludes everything below it
+    return regex + "(?:/.*)?"
+
+
+def parse_rules(lines):
+    """Parse ignore file lines into (regex, negated, dir_only) rules."""
+    rules = []
+    for line in lines:
+        line = line.rstrip("\n")
+        # Trailing spaces are ignored unless escaped
+        stripped = line.rstrip(" ")
+        if stripped.endswith("\\") and len(stripped) < len(line):
+            stripped += " "
+        line = stripped
+        if not line or line.startswith("#"):
+            continue
+
+        negated = line.startswith("!")
+        if negated:
+            line = line[1:]
+        elif line.startswith("\\!") or line.startswith("\\#"):
+            line = line[1:]
+
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        if line:
+            rules.append((_translate(line), negated, dir_only))
+    return rules
+
+
+class IgnoreRules:
+    def __init__(self, rules=()):
+        self.rules = list(rules)
+        self._file_re, self._file_negated = self._compile(
+            [rule for rule in self.rules if not rule[2]]
+        )
+        self._dir_re, self._dir_negated = self._compile(self.rules)
+
+    @classmethod
+    def from_file(cls, path):
+        """Load rules from an ignore file; a missing file means no rules."""
+        try:
+            with open(path, "r") as f:
+                return cls(parse_rules(f))
+        except FileNotFoundError:
+            return cls()
+
+    @staticmethod
+    def _compile(rules):
+        if not rules:
+            return None, []
+        ordered = list(reversed(rules))
+        regex = "|".join(f"({pattern})" for pattern, _, _ in ordered)
+        return re.compile(regex), [negated for _, negated, _ in ordered]
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def match(self, path, is_dir=False):
+        """Check whether a path relative to home is excluded.
+
+        Rules ending in ``/`` only apply to directories, and the last rule that
+        matches decides, so a later ``!pattern`` re-includes a path.
+        """
+        if is_dir:
+            regex, negated = self._dir_re, self._dir_negated
+        else:
+            regex, negated = self._file_re, self._file_negated
+        if regex is None:
+            return False
+        match = regex.fullmatch(path)
+        return match is not None and not negated[match.lastindex - 1]
+
+    def is_excluded(self, path, is_dir=False):
+        """Check a path and, since excluded directories are pruned, its parents."""
+        parts = Path(path).parts
+        for i in range(1, len(parts)):
+            if self.match("/".join(parts[:i]), True):
+                return True
+        return self.match("/".join(parts), is_dir)
+
+    def for_root(self, root):
+        """Get a matcher for paths relative to ``root``, a config relative to home.
+
+        Returns:
+            callable: ``ignore(relative, is_dir)``, or None when there are no
+            rules so walkers can skip matching altogether
+        """
+        if not self.rules:
+            return None
+        prefix = Path(root).as_posix()
+        prefix = "" if prefix == "." else prefix + "/"
+        return lambda relative, is_dir: self.match(prefix + relative, is_dir)
+
+
+def find_excluded(path, ignore):
+    """List the entries below the directory ``path`` that ``ignore`` excludes.
+
+    Excluded directories are listed once, with a trailing ``/``, and not
+    descended into.
+
+    Returns:
+        list: Paths relative to ``path``
+    """
+    found = []
+    if ignore is None or not os.path.isdir(path):
+        return found
+    for directory, dirnames, filenames in os.walk(path):
+        relative = os.path.relpath(directory, path)
+        prefix = "" if relative == "." else relative.replace(os.sep, "/") + "/"
+        kept = []
+        for name in sorted(dirnames):
+            if ignore(prefix + name, True):
+                found.append(prefix + name + "/")
+            else:
+                kept.append(name)
+        dirnames[:] = kept
+        found.extend(
+            prefix + name for name in sorted(filenames) if ignore(prefix + name, False)
+        )
+    return found
+
+
+def copytree_ignore(ignore):
+    """Adapt a matcher to the ``ignore`` callback of ``shutil.copytree``."""
+    if ignore is None:
+        return None
+    root = None
+
+    def ignored_names(directory, names):
+        nonlocal root
+        # copytree calls this for its source root first
+        if root is None:
+            root = directory
+        relative = os.path.relpath(directory, root)
+        prefix = "" if relative == "." else relative.replace(os.sep, "/") + "/"
+        return {
+            name
+            for name in names
+            if ignore(prefix + name, os.path.isdir(os.path.join(directory, name)))
+        }
+
+    return ignored_names
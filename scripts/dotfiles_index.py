@@ -0,0 +1,112 @@
+"""Persisted index of the configurations managed in the dotfiles directory.
+
+The index remembers the listing of every directory together with its mtime.
+Adding, removing or renaming an entry updates the mtime of the directory that
+contains it, so a refresh only needs one ``stat`` per directory and re-reads
+just the directories that changed.
+"""
+
+import json
+import os
+import time
+from pathlib import Path
+
+INDEX_VERSION = 1
+
+
+class ConfigIndex:
+    def __init__(self, root, path):
+        self.root = Path(root)
+        self.path = Path(path)
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            if data.get("version") == INDEX_VERSION and data.get("root") == str(
+                self.root
+            ):
+                return data["dirs"], data["scanned_ns"]
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError) as e:
+            print(f"Ignoring unreadable config index {self.path}: {e}")
+        return {}, 0
+
+    def _save(self, dirs, scanned_ns):
+        tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "version": INDEX_VERSION,
+                    "root": str(self.root),
+                    "scanned_ns": scanned_ns,
+                    "dirs": dirs,
+                },
+                f,
+                separators=(",", ":"),
+            )
+        os.replace(tmp_path, self.path)
+
+    def _scan_dir(self, path, mtime_ns):
+        files = []
+        subdirs = []
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                else:
+                    files.append(entry.name)
+        return {
+            "mtime_ns": mtime_ns,
+            "files": sorted(files),
+            "subdirs": sorted(subdirs),
+        }
+
+    def refresh(self):
+        """Bring the index up to date and return its directory records.
+
+        A cached listing is reused when the directory's mtime is unchanged and
+        older than the previous refresh; directories modified during or after
+        that refresh are read again since their mtime can't be trusted yet.
+        """
+        scanned_ns = time.time_ns()
+        cached, cached_ns = self._load()
+        dirs = {}
+        changed = False
+
+        pending = [""]
+        while pending:
+            relative = pending.pop()
+            path = self.root / relative if relative else self.root
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+
+            record = cached.get(relative)
+            if (
+                record is None
+                or record["mtime_ns"] != mtime_ns
+                or mtime_ns >= cached_ns
+            ):
+                record = self._scan_dir(path, mtime_ns)
+                changed = True
+            dirs[relative] = record
+            pending.extend(
+                f"{relative}/{name}" if relative else name for name in record["subdirs"]
+            )
+
+        if changed or len(dirs) != len(cached):
+            self._save(dirs, scanned_ns)
+        return dirs
+
+    def configs(self):
+        """Get the managed files and empty directories, relative to the root."""
+        configs = []
+        for relative, record in self.refresh().items():
+            prefix = f"{relative}/" if relative else ""
+            configs.extend(prefix + name for name in record["files"])
+            if relative and not record["files"] and not record["subdirs"]:
+                configs.append(relative)
+        return sorted(configs)
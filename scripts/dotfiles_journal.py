@@ -0,0 +1,227 @@
+"""Write-ahead journal that makes batches of add/restore operations atomic.
+
+Every filesystem step is appended to the journal (and fsynced) before it is
+performed, and originals are renamed aside instead of deleted. A batch only
+becomes permanent once its commit record is written; if the process dies
+before that, the next run undoes the recorded steps in reverse order and
+moves the originals back. After a commit the aside copies are removed.
+
+A batch holds an exclusive lock on a sibling ``.lock`` file from recovery to
+commit, so a concurrent run never mistakes it for an abandoned journal.
+"""
+
+import fcntl
+import json
+import os
+import shutil
+from contextlib import contextmanager
+from pathlib import Path
+
+from dotfiles_copy import fast_copy
+
+
+def fsync_dir(path):
+    """Flush a directory entry change (create, rename, unlink) to disk."""
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _remove(path):
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path)
+    elif path.exists() or path.is_symlink():
+        path.unlink()
+
+
+class Transaction:
+    def __init__(self, journal, batch_id):
+        self.journal = journal
+        self.batch_id = batch_id
+        self.steps = []
+        # Whether any file data was written, which must be flushed on commit
+        self.copied = False
+
+    def _temp_name(self, path, purpose):
+        return path.with_name(f".{path.name}.{purpose}-{self.batch_id}")
+
+    def _log(self, step):
+        self.journal.append(step)
+        self.steps.append(step)
+
+    def copy_into_place(self, src, dst, ignore=None):
+        """Copy ``src`` to a staging name next to ``dst`` and rename it into place.
+
+        ``ignore`` is a ``shutil.copytree`` ignore callback for directories.
+        """
+        staging = self._temp_name(dst, "staging")
+        self._log({"op": "create", "path": str(dst), "staging": str(staging)})
+        self.copied = True
+        if src.is_dir():
+            shutil.copytree(src, staging, ignore=ignore, copy_function=fast_copy)
+        else:
+            fast_copy(src, staging)
+        os.rename(staging, dst)
+        fsync_dir(dst.parent)
+
+    def move_aside(self, path):
+        """Rename ``path`` out of the way; it is deleted on commit."""
+        aside = self._temp_name(path, "aside")
+        self._log({"op": "move_aside", "path": str(path), "aside": str(aside)})
+        os.rename(path, aside)
+        fsync_dir(path.parent)
+        return aside
+
+    def symlink(self, path, target):
+        """Atomically create (or replace) ``path`` as a symlink to ``target``."""
+        tmp_link = self._temp_name(path, "link")
+        self._log(
+            {
+                "op": "link",
+                "path": str(path),
+                "target": str(target),
+                "tmp": str(tmp_link),
+            }
+        )
+        os.symlink(target, tmp_link)
+        os.replace(tmp_link, path)
+        fsync_dir(path.parent)
+
+
+class Journal:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock_path = self.path.with_name(self.path.name + ".lock")
+        self._file = None
+
+    @contextmanager
+    def _locked(self, blocking=True):
+        """Hold the journal lock; yields False if it is taken and not blocking."""
+        with open(self.lock_path, "a") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def append(self, record):
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _read(self):
+        records = []
+        try:
+            with open(self.path, "r") as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # A torn final write means that step never started
+                        break
+        except FileNotFoundError:
+            pass
+        return records
+
+    def _clear(self):
+        if self.path.exists():
+            self.path.unlink()
+            fsync_dir(self.path.parent)
+
+    @staticmethod
+    def _undo(step):
+        path = Path(step["path"])
+        if step["op"] == "link":
+            _remove(Path(step["tmp"]))
+            if path.is_symlink() and os.readlink(path) == step["target"]:
+                path.unlink()
+        elif step["op"] == "move_aside":
+            aside = Path(step["aside"])
+            if aside.exists() or aside.is_symlink():
+                _remove(path)
+                os.rename(aside, path)
+        elif step["op"] == "create":
+            _remove(Path(step["staging"]))
+            _remove(path)
+
+    @staticmethod
+    def _finish(steps):
+        for step in steps:
+            if step["op"] == "move_aside":
+                _remove(Path(step["aside"]))
+
+    def recover(self):
+        """Complete or roll back a batch interrupted by a crash.
+
+        A journal whose lock is held belongs to a batch another process is
+        still running, so it is left alone.
+
+        Returns:
+            str: What was done, or None if the journal was empty or in use
+        """
+        with self._locked(blocking=False) as acquired:
+            return self._recover() if acquired else None
+
+    def _recover(self):
+        records = self._read()
+        if not records:
+            self._clear()
+            return None
+
+        steps = [record for record in records if "path" in record]
+        if any(record.get("op") == "commit" for record in records):
+            self._finish(steps)
+            outcome = f"Completed interrupted batch ({len(steps)} steps)"
+        else:
+            for step in reversed(steps):
+                self._undo(step)
+            outcome = f"Rolled back interrupted batch ({len(steps)} steps)"
+        self._clear()
+        return outcome
+
+    @contextmanager
+    def transaction(self):
+        """Run a batch of steps that is committed or rolled back as a whole.
+
+        Waits for any batch running in another process to finish first.
+        """
+        with self._locked():
+            outcome = self._recover()
+            if outcome:
+                print(outcome)
+            with self._run() as tx:
+                yield tx
+
+    @contextmanager
+    def _run(self):
+        batch_id = os.urandom(4).hex()
+        self._file = open(self.path, "w")
+        tx = Transaction(self, batch_id)
+        try:
+            self.append({"op": "begin", "batch": batch_id})
+            yield tx
+        except BaseException:
+            self._file.close()
+            self._file = None
+            for step in reversed(tx.steps):
+                self._undo(step)
+            self._clear()
+            raise
+
+        # Make copied data, and the backups taken of anything moved aside, durable
+        # before the originals are discarded. Renames and links are already
+        # flushed by fsync_dir, so only batches that just create links (such as
+        # restores into empty places) skip the system-wide sync
+        if tx.copied or any(step["op"] == "move_aside" for step in tx.steps):
+            os.sync()
+        self.append({"op": "commit", "batch": batch_id})
+        self._file.close()
+        self._file = None
+        self._finish(tx.steps)
+        self._clear()
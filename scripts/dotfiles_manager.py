@@ -0,0 +1,1753 @@
+"""The dotfile manager: adding, restoring, backing up and syncing configs.
+
+``manage_dotfiles.py`` is the command line entry point; ``main`` here
+implements it.
+"""
+
+import os
+import shutil
+import stat
+from pathlib import Path
+import argparse
+import json
+import sys
+import time
+
+from dotfiles_copy import COPY_FUNCTIONS, COPY_MODES, fast_copy
+from dotfiles_ignore import IGNORE_FILE, IgnoreRules, copytree_ignore, find_excluded
+from dotfiles_index import ConfigIndex
+from dotfiles_journal import Journal
+from dotfiles_retention import (
+    backup_sizes,
+    find_backups,
+    format_size,
+    parse_backup_name,
+    parse_size,
+    select_backups,
+    trim_to_size,
+)
+from dotfiles_store import (
+    ARCHIVE_FORMATS,
+    BackupIndex,
+    BackupStore,
+    MANIFEST_SUFFIX,
+    archive_format,
+    copy_and_hash,
+    entry_path,
+    extract_archive,
+    find_changes,
+    is_manifest,
+    write_archive,
+)
+
+# Modules that only some commands need (inquirer for the menus, the thread
+# pool, diff/watch/template support, datetime) are imported where they are
+# used, which keeps startup fast for non-interactive invocations from shell
+# hooks.
+
+BACKUP_FORMATS = ["dir", "dedup", *ARCHIVE_FORMATS]
+
+# Entries added to the repository, one per line relative to home
+ROOTS_FILE = ".dotfiles_roots"
+# Shared directories whose children are restored individually when they were
+# added before add roots were recorded
+CONTAINER_DIRS = {".config", ".local", ".local/share", ".local/bin"}
+
+
+def handle_keyboard_interrupt():
+    """Handle Ctrl+C gracefully"""
+    print("\nOperation cancelled by user")
+    sys.exit(0)
+
+
+def remove_path(path):
+    """Remove a file, symlink or directory tree."""
+    if path.is_dir() and not path.is_symlink():
+        shutil.rmtree(path)
+    else:
+        path.unlink()
+
+
+def find_unmanaged(home_path, repo_path, limit=3):
+    """Find entries below the real directory ``home_path`` that are missing
+    from ``repo_path``, which replacing the directory with a link would lose.
+
+    Returns:
+        list: Up to ``limit`` paths relative to ``home_path``
+    """
+    found = []
+    for directory, dirnames, filenames in os.walk(home_path):
+        relative = os.path.relpath(directory, home_path)
+        counterpart = os.path.join(repo_path, relative)
+        for name in dirnames + filenames:
+            if not os.path.lexists(os.path.join(counterpart, name)):
+                found.append(os.path.normpath(os.path.join(relative, name)))
+                if len(found) >= limit:
+                    return found
+        # Nothing below a directory the repository lacks needs checking
+        dirnames[:] = [
+            name for name in dirnames if os.path.isdir(os.path.join(counterpart, name))
+        ]
+    return found
+
+
+def same_contents(first, second):
+    """Check whether two files or directory trees hold the same entries and data."""
+    import filecmp
+
+    if first.is_dir() != second.is_dir():
+        return False
+    try:
+        if not first.is_dir():
+            return filecmp.cmp(first, second, shallow=False)
+        for directory, dirnames, filenames in os.walk(first):
+            counterpart = os.path.join(second, os.path.relpath(directory, first))
+            if sorted(dirnames + filenames) != sorted(os.listdir(counterpart)):
+                return False
+            for name in dirnames:
+                if not os.path.isdir(os.path.join(counterpart, name)):
+                    return False
+            for name in filenames:
+                if not filecmp.cmp(
+                    os.path.join(directory, name),
+                    os.path.join(counterpart, name),
+                    shallow=False,
+                ):
+                    return False
+    except OSError:
+        # Dangling links or unreadable entries can't be shown to match
+        return False
+    return True
+
+
+def parallel_map(function, items, jobs, min_items=2):
+    """Map ``function`` over ``items`` in order, on a thread pool when it helps.
+
+    With one job or fewer than ``min_items`` items the calls run inline, which
+    also avoids importing and starting the pool at all.
+    """
+    items = list(items)
+    if jobs <= 1 or len(items) < min_items:
+        yield from map(function, items)
+        return
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=min(jobs, len(items))) as executor:
+        yield from executor.map(function, items)
+
+
+def batch_result(operation, config, ok, message, seconds):
+    """Build the result record the batch API reports for one config."""
+    return {
+        "operation": operation,
+        "config": config,
+        "ok": ok,
+        "message": message,
+        "seconds": round(seconds, 6),
+    }
+
+
+def report_batch(results, jsonl=False):
+    """Print batch results as they arrive, as JSON lines or plain messages.
+
+    Returns:
+        int: Number of configs that failed
+    """
+    failed = 0
+    for result in results:
+        if jsonl:
+            print(json.dumps(result), flush=True)
+        else:
+            print(result["message"], flush=True)
+        failed += not result["ok"]
+    return failed
+
+
+class DotfileManager:
+    def __init__(
+        self,
+        repo_path,
+        backup_format="dir",
+        incremental=False,
+        copy_mode="auto",
+        profile=None,
+    ):
+        self.repo_path = Path(repo_path).resolve()
+        self.dotfiles_dir = self.repo_path / "dotfiles"
+        self.backup_dir = self.repo_path / "dotfiles_backup"
+        self.backup_format = backup_format
+        self.incremental = incremental
+        # How plain directory backups copy files: reflink/kernel copy, hardlink
+        # or a regular read/write copy
+        self.copy_function = COPY_FUNCTIONS[copy_mode]
+        # Host profile for rendering templates; None picks it by hostname
+        self.profile = profile
+        self.store = BackupStore(self.backup_dir)
+        self.index = BackupIndex(self.store.store_dir / "index.json")
+        self.config_index = ConfigIndex(
+            self.dotfiles_dir, self.repo_path / ".dotfiles_index.json"
+        )
+        self.journal = Journal(self.repo_path / ".dotfiles_journal")
+        self.roots_file = self.repo_path / ROOTS_FILE
+        self.ignore_rules = IgnoreRules.from_file(self.repo_path / IGNORE_FILE)
+
+    def setup_directories(self):
+        """Create necessary directories if they don't exist."""
+        self.dotfiles_dir.mkdir(exist_ok=True)
+        self.backup_dir.mkdir(exist_ok=True)
+
+    def recover_journal(self):
+        """Finish or roll back an add/restore batch interrupted by a crash."""
+        outcome = self.journal.recover()
+        if outcome:
+            print(outcome)
+
+    def get_relative_path(self, file_path):
+        """Get the relative path from home directory."""
+        home = Path.home()
+        try:
+            return file_path.relative_to(home)
+        except ValueError:
+            return file_path.name
+
+    def write_backup(self, source, backup_path, ignore=None):
+        """Write a backup of ``source`` using the configured backup format.
+
+        Args:
+            source (Path): File or directory to back up
+            backup_path (Path): Backup location without any format suffix
+            ignore (callable, optional): ``ignore(relative, is_dir)`` for
+                entries to leave out of the backup
+
+        Returns:
+            Path: The location the backup was actually written to
+        """
+        backup_path.parent.mkdir(parents=True, exist_ok=True)
+
+        if self.backup_format == "dedup":
+            manifest_path = backup_path.with_name(backup_path.name + MANIFEST_SUFFIX)
+            return self.store.write_backup(source, manifest_path, ignore=ignore)
+
+        if self.backup_format in ARCHIVE_FORMATS:
+            archive_path = backup_path.with_name(
+                f"{backup_path.name}.{self.backup_format}"
+            )
+            return write_archive(source, archive_path, self.backup_format, ignore)
+
+        if source.is_dir():
+            shutil.copytree(
+                source,
+                backup_path,
+                dirs_exist_ok=True,
+                ignore=copytree_ignore(ignore),
+                copy_function=self.copy_function,
+            )
+        else:
+            self.copy_function(source, backup_path)
+        return backup_path
+
+    def write_incremental_backup(self, config_name, source, backup_path):
+        """Back up only what changed since the last indexed backup of a config.
+
+        Args:
+            config_name (str): Name of the configuration, used as the index key
+            source (Path): File or directory to back up
+            backup_path (Path): Backup location without any format suffix
+
+        Returns:
+            Path: The new backup, or None if nothing changed since the last one
+        """
+        scanned_ns = time.time_ns()
+        ignore = self.ignore_rules.for_root(config_name)
+        entries = self.store.scan(source, ignore)
+        record = self.index.get(config_name)
+        changed = find_changes(source, entries, record)
+
+        previous = self.backup_dir / record["backup"] if record else None
+        if not changed and previous is not None and previous.exists():
+            # Remember refreshed metadata so touched files aren't hashed again
+            self.index.update(config_name, record["backup"], scanned_ns, entries)
+            return None
+
+        backup_path.parent.mkdir(parents=True, exist_ok=True)
+        if self.backup_format == "dedup":
+            manifest_path = backup_path.with_name(backup_path.name + MANIFEST_SUFFIX)
+            backup_path = self.store.write_backup(source, manifest_path, entries)
+        elif self.backup_format in ARCHIVE_FORMATS:
+            backup_path = self.write_backup(source, backup_path, ignore)
+        else:
+            if previous is not None and (
+                is_manifest(previous)
+                or archive_format(previous)
+                or not previous.exists()
+            ):
+                previous = None
+            self._write_dir_incremental(source, backup_path, entries, changed, previous)
+
+        self.index.update(
+            config_name, backup_path.relative_to(self.backup_dir), scanned_ns, entries
+        )
+        return backup_path
+
+    def _write_dir_incremental(self, source, backup_path, entries, changed, previous):
+        """Write a plain directory backup, hardlinking unchanged files from the
+        previous directory backup instead of copying them again."""
+        directories = []
+        for entry in entries:
+            src = entry_path(source, entry["path"])
+            dst = entry_path(backup_path, entry["path"])
+            if entry["type"] == "dir":
+                dst.mkdir(parents=True, exist_ok=True)
+                directories.append((src, dst))
+            elif entry["type"] == "symlink":
+                os.symlink(entry["target"], dst)
+            elif previous is not None and entry["path"] not in changed:
+                try:
+                    os.link(entry_path(previous, entry["path"]), dst)
+                except OSError:
+                    fast_copy(src, dst)
+            else:
+                entry["hash"] = copy_and_hash(src, dst)
+
+        for src, dst in reversed(directories):
+            shutil.copystat(src, dst)
+
+    def backup_existing_path(self, path, relative_path=None):
+        """Create a backup of an existing file or directory with timestamp."""
+        if not path.exists():
+            return None
+
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        if relative_path is None:
+            relative_path = self.get_relative_path(path)
+        backup_path = self.backup_dir / f"{relative_path}_{timestamp}"
+
+        return self.write_backup(path, backup_path)
+
+    def add_dotfile(self, file_path):
+        """Add a dotfile or directory to the repository and create symlinks."""
+        return self.add_dotfiles([file_path])
+
+    def add_dotfiles(self, file_paths, drop_ignored=False):
+        """Add several dotfiles or directories as one atomic batch.
+
+        Everything is backed up first. The copies into the repository, moving
+        the originals aside and linking them are then journaled so that a
+        crash or error leaves either all of the batch or none of it applied.
+        A path already in the repository is only linked if both copies match;
+        otherwise nothing is added.
+
+        Entries excluded by ``.dotfilesignore`` aren't copied into the
+        repository, so linking a directory that holds some removes them from
+        $HOME and leaves them only in the backup. That is refused unless
+        ``drop_ignored`` is set.
+        """
+        items = []
+        excluded = {}
+        for file_path in file_paths:
+            file_path = Path(file_path).expanduser().resolve()
+            if not file_path.exists():
+                print(f"Error: {file_path} does not exist")
+                return False
+            # Get the path relative to home directory
+            relative_path = self.get_relative_path(file_path)
+            repo_path = self.dotfiles_dir / relative_path
+            # Linking to a differing repository copy would discard local edits
+            if repo_path.exists() and not same_contents(file_path, repo_path):
+                print(
+                    f"Error: {repo_path} already exists and differs from "
+                    f"{file_path}; restore it or remove it from the repository "
+                    "first"
+                )
+                return False
+            if not repo_path.exists():
+                ignore = self.ignore_rules.for_root(relative_path)
+                excluded[file_path] = find_excluded(file_path, ignore)
+                if excluded[file_path] and not drop_ignored:
+                    print(
+                        f"Error: {IGNORE_FILE} excludes entries of {file_path} that "
+                        f"linking it would remove: {', '.join(excluded[file_path])}"
+                    )
+                    print(
+                        "Pass --yes to add it anyway, keeping them only in the backup"
+                    )
+                    return False
+            items.append((file_path, repo_path, relative_path))
+
+        backups = {}
+        for file_path, repo_path, _ in items:
+            # Create parent directories in repo
+            repo_path.parent.mkdir(parents=True, exist_ok=True)
+
+            # Backup existing file/directory
+            backups[file_path] = self.backup_existing_path(file_path)
+            if backups[file_path]:
+                print(f"Created backup at {backups[file_path]}")
+
+        # Reported if the batch fails before reaching a particular item
+        failing = ", ".join(str(file_path) for file_path, _, _ in items)
+        try:
+            with self.journal.transaction() as tx:
+                for file_path, repo_path, relative_path in items:
+                    failing = file_path
+                    # Copy into the repo if it isn't there yet, without the
+                    # entries excluded by .dotfilesignore
+                    if not repo_path.exists():
+                        ignore = self.ignore_rules.for_root(relative_path)
+                        tx.copy_into_place(
+                            file_path, repo_path, copytree_ignore(ignore)
+                        )
+                    else:
+                        print(f"Already in repo with the same contents: {repo_path}")
+                    tx.move_aside(file_path)
+                    tx.symlink(file_path, repo_path)
+        except OSError as e:
+            print(f"Error adding {failing}: {str(e)}")
+            print("No changes were made")
+            return False
+
+        self.record_add_roots(relative_path for _, _, relative_path in items)
+        for file_path, repo_path, _ in items:
+            print(f"Created symlink: {file_path} -> {repo_path}")
+            if excluded.get(file_path):
+                print(
+                    f"Removed from {file_path} (excluded by {IGNORE_FILE}, kept in "
+                    f"{backups[file_path]}): {', '.join(excluded[file_path])}"
+                )
+        return True
+
+    def get_add_roots(self):
+        """Get the entries ``add`` linked into $HOME, relative to home."""
+        try:
+            with open(self.roots_file, "r") as f:
+                return {line.strip() for line in f if line.strip()}
+        except FileNotFoundError:
+            return set()
+
+    def record_add_roots(self, relative_paths):
+        """Record added entries so that a full restore links exactly these."""
+        roots = self.get_add_roots()
+        for relative_path in relative_paths:
+            root = Path(relative_path).as_posix()
+            # An entry added as a whole covers those added below it before
+            roots = {r for r in roots if not r.startswith(root + "/")}
+            roots.add(root)
+        tmp_path = self.roots_file.with_name(f".{ROOTS_FILE}.tmp")
+        with open(tmp_path, "w") as f:
+            f.writelines(f"{root}\n" for root in sorted(roots))
+        os.replace(tmp_path, self.roots_file)
+
+    def restore_dotfile(self, file_path, dry_run=False, from_backup=None):
+        """Restore a dotfile or directory from the repository to its original location.
+
+        Args:
+            file_path (str): Configuration to restore, relative to home or absolute
+            dry_run (bool): Only print what would be done
+            from_backup (str, optional): Backup (directory copy, dedup manifest or
+                compressed archive) whose contents replace the repository copy first
+        """
+        from dotfiles_profiles import TEMPLATE_SUFFIX
+
+        # Handle both relative and absolute paths
+        if file_path.startswith("/"):
+            relative_path = self.get_relative_path(Path(file_path))
+        else:
+            relative_path = Path(file_path)
+        if relative_path.name.endswith(TEMPLATE_SUFFIX):
+            relative_path = relative_path.with_name(
+                relative_path.name[: -len(TEMPLATE_SUFFIX)]
+            )
+
+        repo_path = self.dotfiles_dir / relative_path
+        if from_backup:
+            backup_path = Path(from_backup)
+            if not backup_path.is_absolute() and not backup_path.exists():
+                backup_path = self.backup_dir / backup_path
+            if not backup_path.exists():
+                print(f"Error: Backup {from_backup} not found")
+                return False
+            if dry_run:
+                print(f"\nWould replace {repo_path} with the contents of {backup_path}")
+            else:
+                self.extract_backup(backup_path, repo_path, relative_path)
+                print(f"Restored {repo_path} from {backup_path}")
+        else:
+            self.render_templates(dry_run)
+            if not repo_path.exists() and not (
+                dry_run
+                and repo_path.with_name(repo_path.name + TEMPLATE_SUFFIX).exists()
+            ):
+                print(f"Error: {relative_path} not found in repository")
+                return False
+
+        plan = self.plan_restore([relative_path])
+        if dry_run:
+            self.print_restore_plan(plan)
+            return True
+        return self.execute_restore_plan(plan) == 0
+
+    def extract_backup(self, backup_path, destination, relative_path):
+        """Replace ``destination`` with the contents of a backup of any format.
+
+        The current contents are backed up first, and the backup is unpacked
+        next to the destination so it is swapped in with a single rename.
+        """
+        staging = destination.with_name(f".{destination.name}.restore")
+        if staging.exists() or staging.is_symlink():
+            remove_path(staging)
+        destination.parent.mkdir(parents=True, exist_ok=True)
+
+        if is_manifest(backup_path):
+            self.store.extract(backup_path, staging)
+        elif archive_format(backup_path):
+            extract_archive(backup_path, staging)
+        elif backup_path.is_dir():
+            shutil.copytree(
+                backup_path, staging, symlinks=True, copy_function=fast_copy
+            )
+        else:
+            fast_copy(backup_path, staging)
+
+        if destination.exists() or destination.is_symlink():
+            backup = self.backup_existing_path(destination, relative_path)
+            if backup:
+                print(f"Created backup at {backup}")
+            remove_path(destination)
+        os.replace(staging, destination)
+
+    def render_templates(self, dry_run=False, verbose=True):
+        """Render managed ``.tmpl`` files for the active host profile.
+
+        Only templates whose source, profile variables or rendered output
+        changed since the last render are rendered again. ``verbose=False``
+        suppresses the per-template messages.
+
+        Returns:
+            int: Number of templates (re-)rendered
+        """
+        from dotfiles_profiles import (
+            PROFILES_FILE,
+            TEMPLATE_SUFFIX,
+            TemplateRenderer,
+            load_profile,
+        )
+
+        templates = [
+            config
+            for config in self.get_managed_configs()
+            if config.endswith(TEMPLATE_SUFFIX)
+        ]
+        if not templates:
+            return 0
+
+        profile, variables = load_profile(self.repo_path / PROFILES_FILE, self.profile)
+        renderer = TemplateRenderer(
+            self.dotfiles_dir, self.repo_path / ".dotfiles_render_cache.json", variables
+        )
+        rendered = 0
+        for template, output, status in renderer.render_all(templates, dry_run):
+            if status == "rendered":
+                rendered += 1
+                if not verbose:
+                    continue
+                action = "Would render" if dry_run else "Rendered"
+                print(f"{action} {template} for profile '{profile}'")
+        return rendered
+
+    def get_restore_roots(self):
+        """Get the managed entries that a full restore links into $HOME.
+
+        These are the entries recorded by ``add``. Directories above them are
+        descended into, never linked, so e.g. adding ``~/.ssh/config`` leaves
+        the rest of ``~/.ssh`` alone. Entries added before roots were recorded
+        are linked at the deepest level whose home parent is a real directory,
+        with shared containers such as ``.config`` always descended into.
+        """
+        from dotfiles_profiles import TEMPLATE_SUFFIX
+
+        home = Path.home()
+        recorded = self.get_add_roots()
+        above_recorded = {
+            parent.as_posix() for root in recorded for parent in Path(root).parents
+        }
+        roots = []
+        pending = [Path()]
+        while pending:
+            relative = pending.pop()
+            with os.scandir(self.dotfiles_dir / relative) as it:
+                for entry in it:
+                    child = relative / entry.name
+                    name = child.as_posix()
+                    if entry.name.endswith(TEMPLATE_SUFFIX) and entry.is_file():
+                        # Templates are linked through their rendered output
+                        continue
+                    if name in recorded:
+                        roots.append(child)
+                    elif entry.is_dir(follow_symlinks=False) and (
+                        name in above_recorded
+                        or name in CONTAINER_DIRS
+                        or ((home / child).is_dir() and not (home / child).is_symlink())
+                    ):
+                        pending.append(child)
+                    else:
+                        roots.append(child)
+        return sorted(roots)
+
+    def plan_restore(self, relative_paths):
+        """Work out what restoring the given configs involves.
+
+        Each home path is inspected with a single ``lstat``/``readlink`` and no
+        filesystem changes are made. A real directory holding entries that the
+        repository doesn't manage is never replaced; its step is a "conflict".
+
+        Returns:
+            dict: ``steps`` with one entry per config and the sorted ``mkdirs``
+            parent directories that have to be created
+        """
+        home = Path.home()
+        steps = []
+        mkdirs = set()
+
+        for relative_path in relative_paths:
+            repo_path = self.dotfiles_dir / relative_path
+            home_path = home / relative_path
+            step = {
+                "config": str(relative_path),
+                "home": home_path,
+                "repo": repo_path,
+                "action": "link",
+                "backup": False,
+                "remove": None,
+            }
+            try:
+                st = home_path.lstat()
+            except FileNotFoundError:
+                st = None
+
+            if st is None:
+                if not home_path.parent.is_dir():
+                    mkdirs.add(home_path.parent)
+            elif os.path.realpath(home_path.parent) == os.path.realpath(
+                repo_path.parent
+            ):
+                # Already reachable through a linked parent directory; linking
+                # it again would replace the repository copy with a link to itself
+                step["action"] = "skip"
+            elif stat.S_ISLNK(st.st_mode):
+                if os.readlink(home_path) == str(repo_path):
+                    step["action"] = "skip"
+                else:
+                    # Only back up links that still point at something
+                    step["backup"] = home_path.exists()
+                    step["remove"] = "file"
+            elif stat.S_ISDIR(st.st_mode):
+                unmanaged = find_unmanaged(home_path, repo_path)
+                if unmanaged:
+                    # Linking would move these into a backup and out of $HOME
+                    step["action"] = "conflict"
+                    step["detail"] = (
+                        f"{home_path}: it holds entries the repository doesn't "
+                        f"manage ({', '.join(unmanaged)})"
+                    )
+                else:
+                    step["backup"] = True
+                    step["remove"] = "tree"
+            else:
+                step["backup"] = True
+                step["remove"] = "file"
+            steps.append(step)
+
+        # Parents of other missing parents are created by mkdir(parents=True)
+        mkdirs = sorted(
+            path for path in mkdirs if not any(p in mkdirs for p in path.parents)
+        )
+        return {"steps": steps, "mkdirs": mkdirs}
+
+    def print_restore_plan(self, plan):
+        """Print a restore plan without executing it."""
+        print("\nRestore plan:")
+        for path in plan["mkdirs"]:
+            print(f"  mkdir   {path}")
+        for step in plan["steps"]:
+            if step["action"] == "skip":
+                print(f"  ok      {step['home']} (already linked)")
+                continue
+            if step["action"] == "conflict":
+                print(f"  refuse  {step['detail']}")
+                continue
+            if step["backup"]:
+                print(f"  backup  {step['home']}")
+            if step["remove"]:
+                print(f"  remove  {step['home']}")
+            print(f"  link    {step['home']} -> {step['repo']}")
+
+    def _run_restore_plan(self, plan, jobs=1):
+        """Execute a plan created by ``plan_restore`` without printing anything.
+
+        Pre-restore backups run concurrently; a config whose backup fails is
+        left untouched. The replacements themselves run as one journaled
+        transaction, so an error rolls all of them back. Every step gets a
+        ``status`` ("restored", "skipped" or "failed"), a ``message`` and the
+        ``seconds`` spent on it.
+        """
+        for step in plan["steps"]:
+            step["seconds"] = 0.0
+            step["backup_path"] = None
+            if step["action"] == "skip":
+                step["status"] = "skipped"
+                step["message"] = f"{step['config']} is already linked"
+            elif step["action"] == "conflict":
+                step["status"] = "failed"
+                step["message"] = f"Refusing to replace {step['detail']}"
+        steps = [step for step in plan["steps"] if step["action"] == "link"]
+
+        def backup(step):
+            start = time.perf_counter()
+            try:
+                step["backup_path"] = self.backup_existing_path(step["home"])
+            except Exception as e:
+                step["action"] = "failed"
+                step["status"] = "failed"
+                step["message"] = f"Error backing up {step['home']}: {str(e)}"
+            step["seconds"] += time.perf_counter() - start
+
+        list(parallel_map(backup, [step for step in steps if step["backup"]], jobs))
+
+        for path in plan["mkdirs"]:
+            path.mkdir(parents=True, exist_ok=True)
+
+        pending = [step for step in steps if step["action"] == "link"]
+        try:
+            with self.journal.transaction() as tx:
+                for step in pending:
+                    start = time.perf_counter()
+                    if step["remove"]:
+                        tx.move_aside(step["home"])
+                    tx.symlink(step["home"], step["repo"])
+                    step["seconds"] += time.perf_counter() - start
+        except OSError as e:
+            plan["error"] = f"Error restoring {step['config']}: {str(e)}"
+            for step in pending:
+                step["status"] = "failed"
+                step["message"] = f"Rolled back: {plan['error']}"
+            return
+
+        for step in pending:
+            step["status"] = "restored"
+            step["message"] = f"Restored {step['config']} to {step['home']}"
+
+    def execute_restore_plan(self, plan, jobs=1):
+        """Execute a plan created by ``plan_restore`` and report the outcome.
+
+        Returns:
+            int: Number of configs that failed to restore
+        """
+        self._run_restore_plan(plan, jobs)
+        steps = plan["steps"]
+
+        for step in steps:
+            if step["backup_path"]:
+                print(f"Created backup at {step['backup_path']}")
+            elif step["action"] in ("failed", "conflict"):
+                print(step["message"])
+
+        if "error" in plan:
+            print(plan["error"])
+            print("Rolled back the restore, no links were changed")
+        else:
+            for step in steps:
+                if step["status"] == "restored":
+                    print(step["message"])
+
+        for step in steps:
+            if step["status"] == "skipped":
+                print(step["message"])
+        return sum(step["status"] == "failed" for step in steps)
+
+    def restore_all(self, jobs=1, dry_run=False):
+        """Restore every managed configuration in one planned pass."""
+        self.render_templates(dry_run)
+        plan = self.plan_restore(self.get_restore_roots())
+        if dry_run:
+            self.print_restore_plan(plan)
+            return True
+
+        failed = self.execute_restore_plan(plan, jobs=jobs)
+        restored = len(plan["steps"]) - failed
+        print(f"\nRestore complete: {restored} succeeded, {failed} failed")
+        return failed == 0
+
+    def get_link_status(self, home_path, repo_path):
+        """Classify a home path against its repository counterpart.
+
+        Usually needs a single ``readlink``; only links whose target text
+        differs from the repository path are resolved.
+
+        Returns:
+            tuple: (status, link target or None) where status is one of
+            "linked", "broken", "unlinked" or "directory"
+        """
+        try:
+            target = os.readlink(home_path)
+        except FileNotFoundError:
+            return "unlinked", None
+        except OSError:
+            # Not a symlink: a real directory can still hold linked children
+            if home_path.is_dir():
+                return "directory", None
+            return "unlinked", None
+
+        if target == str(repo_path):
+            return "linked", target
+        absolute = os.path.join(home_path.parent, target)
+        if os.path.realpath(absolute) == os.path.realpath(repo_path):
+            return "linked", target
+        return "broken", target
+
+    def scan_status(self, depth=None):
+        """Build a tree of managed entries with their link status.
+
+        Each repository directory is read with one ``os.scandir`` and $HOME is
+        only probed below real directories; entries under a linked or missing
+        directory inherit their status without further syscalls. Templates are
+        shown as the file they render to, and not at all once it has been
+        rendered, since only the output is ever linked.
+
+        Args:
+            depth (int, optional): Maximum depth to descend, 1 being the top level
+
+        Returns:
+            list: Nodes with ``path``, ``is_dir``, ``status``, ``home``,
+            ``target``, ``template`` (the source of an unrendered template) and
+            ``children``
+        """
+        from dotfiles_profiles import TEMPLATE_SUFFIX
+
+        home = Path.home()
+
+        def scan(directory, relative, level, parent_status):
+            nodes = []
+            with os.scandir(directory) as it:
+                entries = sorted(
+                    it, key=lambda e: (not e.is_dir(follow_symlinks=False), e.name)
+                )
+            names = {entry.name for entry in entries}
+            for entry in entries:
+                name, template = entry.name, None
+                if name.endswith(TEMPLATE_SUFFIX) and entry.is_file():
+                    name = name[: -len(TEMPLATE_SUFFIX)]
+                    if name in names:
+                        continue
+                    template = (relative / entry.name).as_posix()
+                child = relative / name
+                home_path = home / child
+                if parent_status in ("linked", "via-parent"):
+                    status, target = "via-parent", None
+                elif parent_status in (None, "directory"):
+                    status, target = self.get_link_status(
+                        home_path, os.path.join(directory, name)
+                    )
+                else:
+                    # Nothing below a missing or broken parent can be linked
+                    status, target = "unlinked", None
+                node = {
+                    "path": child.as_posix(),
+                    "is_dir": entry.is_dir(follow_symlinks=False),
+                    "status": status,
+                    "home": str(home_path),
+                    "target": target,
+                    "template": template,
+                    "children": [],
+                }
+                if node["is_dir"] and (depth is None or level < depth):
+                    node["children"] = scan(entry.path, child, level + 1, status)
+                nodes.append(node)
+            return nodes
+
+        if not self.dotfiles_dir.is_dir():
+            return []
+        return scan(self.dotfiles_dir, Path(), 1, None)
+
+    def check_link(self, relative_path):
+        """Check that one managed entry is correctly linked from $HOME.
+
+        Returns:
+            dict: ``config``, ``problem`` (None when healthy, otherwise one of
+            "missing", "dangling", "wrong-target" or "shadowed") and ``detail``
+        """
+        home_path = Path.home() / relative_path
+        repo_path = self.dotfiles_dir / relative_path
+        status, target = self.get_link_status(home_path, repo_path)
+        result = {"config": relative_path.as_posix(), "problem": None, "detail": ""}
+
+        if status == "broken":
+            if os.path.exists(home_path):
+                result["problem"] = "wrong-target"
+                result["detail"] = f"{home_path} -> {target}"
+            else:
+                result["problem"] = "dangling"
+                result["detail"] = f"{home_path} -> {target} (missing)"
+        elif status == "directory" or (status == "unlinked" and home_path.exists()):
+            result["problem"] = "shadowed"
+            result["detail"] = f"{home_path} is a real file or directory"
+            unmanaged = status == "directory" and find_unmanaged(home_path, repo_path)
+            if unmanaged:
+                result["detail"] = (
+                    f"{home_path} is a real directory holding unmanaged entries "
+                    f"({', '.join(unmanaged)}); --fix leaves it alone"
+                )
+        elif status == "unlinked":
+            result["problem"] = "missing"
+            result["detail"] = f"{home_path} does not exist"
+        return result
+
+    def doctor(self, fix=False, jobs=8):
+        """Verify every managed entry concurrently and optionally repair it.
+
+        The entries checked are the restore roots, i.e. the paths ``add``
+        linked. Repairs go through the same plan as ``restore_dotfile``, so
+        shadowing files are backed up before they are replaced with links and
+        directories holding files the repository doesn't manage are refused.
+
+        Returns:
+            int: Number of problems left after any repairs
+        """
+        start = time.perf_counter()
+        roots = self.get_restore_roots()
+        # A check is a readlink or two; threads only pay off for many roots
+        results = list(parallel_map(self.check_link, roots, jobs, min_items=jobs * 4))
+        elapsed = time.perf_counter() - start
+
+        problems = [result for result in results if result["problem"]]
+        for result in problems:
+            print(f"{result['problem']:<13} {result['config']}: {result['detail']}")
+        print(
+            f"Checked {len(results)} managed entries in {elapsed * 1000:.1f}ms: "
+            f"{len(problems)} problem(s)"
+        )
+
+        if fix and problems:
+            plan = self.plan_restore([Path(result["config"]) for result in problems])
+            failed = self.execute_restore_plan(plan, jobs=jobs)
+            print(f"Repaired {len(problems) - failed} of {len(problems)} entries")
+            return failed
+        return len(problems)
+
+    def list_dotfiles(
+        self, depth=None, only_broken=False, only_unlinked=False, as_json=False
+    ):
+        """List all dotfiles in the repository with their symlink status.
+
+        Args:
+            depth (int, optional): Maximum depth of the tree to show
+            only_broken (bool): Only show links that are dangling or point elsewhere
+            only_unlinked (bool): Only show entries that aren't linked at all
+            as_json (bool): Print the matching entries as a flat JSON list
+        """
+        wanted = set()
+        if only_broken:
+            wanted.add("broken")
+        if only_unlinked:
+            wanted.add("unlinked")
+
+        def prune(nodes):
+            """Keep matching nodes and the directories leading to them."""
+            kept = []
+            for node in nodes:
+                node["children"] = prune(node["children"])
+                if not wanted or node["status"] in wanted or node["children"]:
+                    kept.append(node)
+            return kept
+
+        tree = prune(self.scan_status(depth))
+
+        if as_json:
+
+            def flatten(nodes):
+                for node in nodes:
+                    if not wanted or node["status"] in wanted:
+                        yield {k: v for k, v in node.items() if k != "children"}
+                    yield from flatten(node["children"])
+
+            print(json.dumps(list(flatten(tree)), indent=2))
+            return
+
+        print("\nManaged dotfiles:")
+
+        def print_tree(nodes, prefix=""):
+            for i, node in enumerate(nodes):
+                is_last = i == len(nodes) - 1
+                current_prefix = "└── " if is_last else "├── "
+                child_prefix = prefix + ("    " if is_last else "│   ")
+
+                print(f"{prefix}{current_prefix}{node['path']}")
+                if node["template"]:
+                    print(
+                        f"{child_prefix}→ Rendered from {node['template']} on restore"
+                    )
+
+                status = node["status"]
+                if status == "linked":
+                    print(f"{child_prefix}→ {node['home']} -> {node['target']}")
+                elif status == "via-parent":
+                    print(f"{child_prefix}→ Linked through parent directory")
+                elif status == "broken":
+                    print(
+                        f"{child_prefix}→ Broken link: {node['home']} -> {node['target']}"
+                    )
+                elif status == "directory":
+                    print(f"{child_prefix}→ Not linked (directory exists in home)")
+                else:
+                    print(f"{child_prefix}→ Not linked")
+
+                print_tree(node["children"], child_prefix)
+
+        print_tree(tree)
+
+    def get_managed_configs(self):
+        """Get list of all managed configurations."""
+        return self.config_index.configs()
+
+    def create_backup(self, config_name, backup_name=None):
+        """Create a backup of a managed configuration.
+
+        Args:
+            config_name (str): Name of the configuration to backup
+            backup_name (str, optional): Custom name for the backup. If None, uses timestamp
+
+        Returns:
+            bool: True if backup was successful, False otherwise
+        """
+        success, message = self._backup_config(config_name, backup_name)
+        print(message)
+        self.index.save()
+        return success
+
+    def _backup_config(self, config_name, backup_name=None):
+        """Back up a single configuration without printing anything.
+
+        Returns:
+            tuple: (success, message) describing the outcome
+        """
+        config_path = self.dotfiles_dir / config_name
+        if not config_path.exists():
+            return (
+                False,
+                f"Error: Configuration '{config_name}' not found in repository",
+            )
+
+        # Construct home path correctly (handling .config and other nested paths)
+        home_path = Path.home() / config_name
+        if not home_path.exists():
+            return False, f"Error: No active configuration at {home_path}"
+
+        # Create backup with custom name or timestamp
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        backup_suffix = backup_name if backup_name else timestamp
+        backup_path = self.backup_dir / f"{config_name}_{backup_suffix}"
+
+        try:
+            if self.incremental:
+                new_backup = self.write_incremental_backup(
+                    config_name, home_path, backup_path
+                )
+                if new_backup is None:
+                    return True, f"No changes in {config_name} since the last backup"
+                backup_path = new_backup
+            else:
+                backup_path = self.write_backup(
+                    home_path, backup_path, self.ignore_rules.for_root(config_name)
+                )
+            return True, f"Created backup at {backup_path}"
+        except Exception as e:
+            return False, f"Error creating backup: {str(e)}"
+
+    def get_backup_configs(self):
+        """Get the managed configs a full backup covers.
+
+        Configs excluded by ``.dotfilesignore`` and templates (which have no
+        counterpart in home) are left out.
+        """
+        from dotfiles_profiles import TEMPLATE_SUFFIX
+
+        return [
+            config
+            for config in self.get_managed_configs()
+            if not self.ignore_rules.is_excluded(config)
+            and not config.endswith(TEMPLATE_SUFFIX)
+        ]
+
+    def backup_batch(self, configs=None, backup_name=None, jobs=1):
+        """Back up configs without any prompts, yielding a result per config.
+
+        Args:
+            configs (list, optional): Configs to back up. Defaults to all of them
+            backup_name (str, optional): Custom name instead of a timestamp
+            jobs (int): Number of configs to back up concurrently. Results are
+                still yielded in config order, each as soon as it is done
+
+        Yields:
+            dict: ``batch_result`` records for the "backup" operation
+        """
+        if configs is None:
+            configs = self.get_backup_configs()
+
+        def run(config):
+            start = time.perf_counter()
+            success, message = self._backup_config(config, backup_name)
+            return batch_result(
+                "backup", config, success, message, time.perf_counter() - start
+            )
+
+        try:
+            yield from parallel_map(run, configs, jobs)
+        finally:
+            self.index.save()
+
+    def restore_batch(self, configs=None, jobs=1, dry_run=False):
+        """Restore configs without any prompts, yielding a result per config.
+
+        The restore is applied as one transaction, so results are yielded once
+        it has been committed or rolled back.
+
+        Args:
+            configs (list, optional): Configs relative to home, or absolute
+                paths. Defaults to every restore root
+            jobs (int): Number of pre-restore backups to run concurrently
+            dry_run (bool): Only report what would be done
+
+        Yields:
+            dict: ``batch_result`` records for the "restore" operation
+        """
+        from dotfiles_profiles import TEMPLATE_SUFFIX
+
+        self.render_templates(dry_run, verbose=False)
+        if configs is None:
+            relative_paths = self.get_restore_roots()
+        else:
+            relative_paths = []
+            for config in configs:
+                path = Path(config)
+                if path.is_absolute():
+                    path = Path(self.get_relative_path(path))
+                if path.name.endswith(TEMPLATE_SUFFIX):
+                    path = path.with_name(path.name[: -len(TEMPLATE_SUFFIX)])
+                relative_paths.append(path)
+
+        missing = [p for p in relative_paths if not (self.dotfiles_dir / p).exists()]
+        for path in missing:
+            yield batch_result(
+                "restore", str(path), False, f"{path} not found in repository", 0.0
+            )
+        plan = self.plan_restore([p for p in relative_paths if p not in missing])
+
+        if dry_run:
+            for step in plan["steps"]:
+                if step["action"] == "skip":
+                    message = f"{step['config']} is already linked"
+                elif step["action"] == "conflict":
+                    message = f"Would refuse to replace {step['detail']}"
+                    yield batch_result("restore", step["config"], False, message, 0.0)
+                    continue
+                else:
+                    message = f"Would link {step['home']} -> {step['repo']}"
+                    if step["backup"]:
+                        message += " after backing it up"
+                yield batch_result("restore", step["config"], True, message, 0.0)
+            return
+
+        self._run_restore_plan(plan, jobs)
+        for step in plan["steps"]:
+            message = step["message"]
+            if step["backup_path"]:
+                message += f" (backed up to {step['backup_path']})"
+            yield batch_result(
+                "restore",
+                step["config"],
+                step["status"] != "failed",
+                message,
+                step["seconds"],
+            )
+
+    def backup_all(self, jobs=1):
+        """Create backups of all managed configurations.
+
+        Args:
+            jobs (int): Number of configs to back up concurrently. Results are
+                still reported in config order
+        """
+        import inquirer
+
+        backed_up = 0
+        failed = 0
+
+        backup_name = None
+        questions = [
+            inquirer.Text(
+                "backup_name",
+                message="Enter backup name for all configs (press Enter for timestamp)",
+            )
+        ]
+        try:
+            answers = inquirer.prompt(questions)
+            if answers is None:  # User pressed Esc/Ctrl+C
+                return False
+            backup_name = answers["backup_name"]
+        except KeyboardInterrupt:
+            handle_keyboard_interrupt()
+
+        for result in self.backup_batch(backup_name=backup_name, jobs=jobs):
+            print(f"\nBacking up {result['config']}...")
+            print(result["message"])
+            if result["ok"]:
+                backed_up += 1
+            else:
+                failed += 1
+
+        print(f"\nBackup complete: {backed_up} succeeded, {failed} failed")
+        return backed_up > 0
+
+    def resolve_snapshot(self, spec):
+        """Find a backup or live config by path, name in the backup directory,
+        or name in the dotfiles directory (in that order)."""
+        path = Path(spec)
+        for candidate in [path, self.backup_dir / path, self.dotfiles_dir / path]:
+            if candidate.exists() or candidate.is_symlink():
+                return candidate
+        raise FileNotFoundError(f"No backup or config named {spec}")
+
+    def backup_config_name(self, backup_path):
+        """Get the config a backup was taken of, from its file name."""
+        relative = backup_path.relative_to(self.backup_dir)
+        parsed = parse_backup_name(relative)
+        if parsed:
+            return parsed[0]
+        # Custom backup names are "<config>_<name>" with an optional suffix
+        name = relative.name
+        for suffix in [MANIFEST_SUFFIX, *(f".{fmt}" for fmt in ARCHIVE_FORMATS)]:
+            name = name.removesuffix(suffix)
+        return (relative.parent / name.rsplit("_", 1)[0]).as_posix()
+
+    def diff(self, first, second=None):
+        """Show what changed between two backups, or a backup and the live config.
+
+        Args:
+            first (str): The older backup (or config) to compare against
+            second (str, optional): The newer one. Defaults to the live
+                repository copy of the config ``first`` is a backup of
+
+        Returns:
+            int: Number of paths that differ
+        """
+        from dotfiles_diff import Snapshot, diff_snapshots
+
+        old_path = self.resolve_snapshot(first)
+        if second:
+            new_path = self.resolve_snapshot(second)
+        else:
+            if not old_path.is_relative_to(self.backup_dir):
+                raise ValueError(f"{first} is not a backup; give two snapshots")
+            new_path = self.dotfiles_dir / self.backup_config_name(old_path)
+
+        if old_path.is_relative_to(self.backup_dir):
+            name = self.backup_config_name(old_path)
+        else:
+            name = self.get_relative_path(old_path)
+
+        differences = 0
+        with (
+            Snapshot(old_path, self.store) as old,
+            Snapshot(new_path, self.store) as new,
+        ):
+            for status, path, lines in diff_snapshots(old, new, str(name)):
+                differences += 1
+                if status == "added":
+                    print(f"Only in {new_path}: {path}")
+                elif status == "removed":
+                    print(f"Only in {old_path}: {path}")
+                elif status == "type":
+                    print(f"File type of {path} changed")
+                else:
+                    print(f"diff {path}")
+                    for line in lines:
+                        print(line)
+                sys.stdout.flush()
+
+        if not differences:
+            print(f"No differences between {old_path} and {new_path}")
+        return differences
+
+    def watch(self, debounce=2.0, max_delay=30.0):
+        """Back up managed configs whenever they change, until interrupted.
+
+        Backups are always incremental, so each snapshot only stores the files
+        that changed since the previous one.
+
+        Args:
+            debounce (float): Seconds without writes before a burst is backed up
+            max_delay (float): Longest a changed file waits for its backup
+        """
+        from dotfiles_watch import ALL_CHANGED, watch_changes
+
+        self.incremental = True
+        print(f"Watching {self.dotfiles_dir} for changes (Ctrl+C to stop)")
+        try:
+            for changed in watch_changes(self.dotfiles_dir, debounce, max_delay):
+                configs = self.get_backup_configs()
+                if ALL_CHANGED not in changed:
+                    configs = [config for config in configs if config in changed]
+                for config in configs:
+                    success, message = self._backup_config(config)
+                    print(message)
+                self.index.save()
+        except KeyboardInterrupt:
+            self.index.save()
+            print("\nStopped watching")
+
+    def sync(self, target, direction, ssh="ssh"):
+        """Push the repository to another host or pull it from there.
+
+        Only changed blocks of changed files are transferred. Nothing is
+        deleted on the receiving side.
+
+        Args:
+            target (str): ``host:path`` of the remote repository, or a local
+                directory
+            direction (str): "push" or "pull"
+            ssh (str): Command used to reach the host, e.g. "ssh -p 2222"
+
+        Returns:
+            dict: Transfer statistics (see ``dotfiles_sync.sync``)
+        """
+        from dotfiles_sync import sync
+
+        start = time.perf_counter()
+        stats = sync(self.repo_path, target, direction, ssh)
+        seconds = time.perf_counter() - start
+
+        if direction == "push":
+            print(
+                f"Pushed to {target}: {stats['updated']} of {stats['files']} files "
+                f"updated, {stats['literal_bytes']} of {stats['total_bytes']} "
+                f"bytes sent ({seconds:.2f}s)"
+            )
+        else:
+            print(
+                f"Pulled from {target}: {stats['updated']} files updated "
+                f"({seconds:.2f}s)"
+            )
+        return stats
+
+    def collect_garbage(
+        self,
+        keep_last=None,
+        keep_daily=None,
+        keep_weekly=None,
+        max_bytes=None,
+        dry_run=False,
+    ):
+        """Prune timestamped backups by retention policy.
+
+        Policies are applied per config and a backup survives if any of them
+        selects it. Custom-named backups are never removed. Afterwards, objects
+        in the dedup store that no remaining manifest references are deleted.
+
+        Args:
+            keep_last (int, optional): Keep the N newest backups
+            keep_daily (int, optional): Keep the newest backup of the last N days
+            keep_weekly (int, optional): Keep the newest backup of the last N weeks
+            max_bytes (int, optional): Remove the oldest remaining backups until
+                the total fits, always keeping each config's newest backup
+            dry_run (bool): Only report what would be removed
+
+        Returns:
+            int: Number of backups removed (or that would be removed)
+        """
+        backups = find_backups(self.backup_dir)
+        by_config = {}
+        for backup in backups:
+            by_config.setdefault(backup["config"], []).append(backup)
+
+        keep = set()
+        for group in by_config.values():
+            keep |= select_backups(group, keep_last, keep_daily, keep_weekly)
+        if max_bytes is not None:
+            sizes = backup_sizes(backups, self.store)
+            keep = trim_to_size(backups, keep, sizes, max_bytes)
+
+        removed = sorted(
+            (backup for backup in backups if backup["path"] not in keep),
+            key=lambda b: b["path"],
+        )
+        for backup in removed:
+            relative = backup["path"].relative_to(self.backup_dir)
+            print(f"{'Would remove' if dry_run else 'Removing'} {relative}")
+            if not dry_run:
+                remove_path(backup["path"])
+
+        removed_paths = {backup["path"] for backup in removed}
+        manifests = [
+            path for path in self.store.find_manifests() if path not in removed_paths
+        ]
+        objects, freed = self.store.prune_objects(
+            self.store.referenced_objects(manifests), dry_run=dry_run
+        )
+
+        print(
+            f"\n{'Would remove' if dry_run else 'Removed'} {len(removed)} of "
+            f"{len(backups)} backups and {objects} unreferenced objects "
+            f"({format_size(freed)})"
+        )
+        return len(removed)
+
+
+def prompt_for_config(manager, message="Select configuration"):
+    """Prompt user to select a configuration."""
+    import inquirer
+
+    configs = manager.get_managed_configs()
+    if not configs:
+        print("No configurations found in repository")
+        return None
+
+    try:
+        questions = [
+            inquirer.List("config", message=message, choices=configs, carousel=True)
+        ]
+        answers = inquirer.prompt(questions)
+        return answers["config"] if answers else None
+    except KeyboardInterrupt:
+        handle_keyboard_interrupt()
+
+
+def show_operation_menu(manager, operation="restore"):
+    """Show consistent menu for backup/restore operations."""
+    import inquirer
+
+    try:
+        questions = [
+            inquirer.List(
+                "choice",
+                message=f"{operation.capitalize()} options",
+                choices=[
+                    f"{operation.capitalize()} all",
+                    f"Select specific config to {operation}",
+                    "Cancel",
+                ],
+                carousel=True,
+            )
+        ]
+        answers = inquirer.prompt(questions)
+        if answers is None:  # User pressed Esc
+            print("\nOperation cancelled by user")
+            return None
+
+        return answers["choice"] if answers else None
+    except KeyboardInterrupt:
+        handle_keyboard_interrupt()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Manage dotfiles and directories with symlinks"
+    )
+    parser.add_argument(
+        "--repo", type=str, default=os.getcwd(), help="Path to the dotfiles repository"
+    )
+    parser.add_argument(
+        "command",
+        choices=[
+            "add",
+            "restore",
+            "list",
+            "backup",
+            "gc",
+            "doctor",
+            "watch",
+            "diff",
+            "push",
+            "pull",
+        ],
+        help="Command to execute",
+    )
+    parser.add_argument(
+        "files",
+        nargs="*",
+        metavar="file",
+        help="Files/directories to add, restore, or backup (optional for "
+        "restore/backup). add applies several paths as one atomic batch and "
+        "restore/backup handle several like --yes; diff takes one or two "
+        "backups; push/pull take host:path or a directory",
+    )
+    parser.add_argument(
+        "--name", type=str, help="Custom name for backup (optional, for backup command)"
+    )
+    parser.add_argument(
+        "--format",
+        choices=BACKUP_FORMATS,
+        help="Backup format: plain copies (dir), a deduplicating object store "
+        "(dedup) or a compressed archive (tar.zst, tar.xz). Defaults to dedup "
+        "for watch and dir otherwise",
+    )
+    parser.add_argument(
+        "--from-backup",
+        type=str,
+        help="Restore a config's repository copy from this backup (for restore command)",
+    )
+
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only back up configs that changed since their last indexed backup",
+    )
+
+    parser.add_argument(
+        "--copy-mode",
+        choices=COPY_MODES,
+        default="auto",
+        help="How dir backups copy files: reflink or kernel-side copy where "
+        "supported (auto), hardlinks to the live files (hardlink) or plain copies "
+        "(copy). Hardlinked backups share inodes with the live files, so editing "
+        "a file in place changes its backups too",
+    )
+
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        help="Number of configs to process in parallel "
+        "(for backup/restore all and doctor)",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Print the restore plan or backups to remove without changing anything",
+    )
+    parser.add_argument(
+        "--fix",
+        action="store_true",
+        help="Repair problems found by doctor by restoring the affected links",
+    )
+    parser.add_argument(
+        "--depth", type=int, help="Maximum tree depth to show (for list)"
+    )
+    parser.add_argument(
+        "--only-broken",
+        action="store_true",
+        help="Only show dangling or misdirected links (for list)",
+    )
+    parser.add_argument(
+        "--only-unlinked",
+        action="store_true",
+        help="Only show entries that are not linked into home (for list)",
+    )
+    parser.add_argument(
+        "--json", action="store_true", help="Print machine-readable JSON (for list)"
+    )
+    parser.add_argument(
+        "--keep-last", type=int, help="Keep the N newest backups per config (for gc)"
+    )
+    parser.add_argument(
+        "--keep-daily",
+        type=int,
+        help="Keep the newest backup of the last N days per config (for gc)",
+    )
+    parser.add_argument(
+        "--keep-weekly",
+        type=int,
+        help="Keep the newest backup of the last N weeks per config (for gc)",
+    )
+    parser.add_argument(
+        "--max-size",
+        type=parse_size,
+        help="Total size to prune backups down to, e.g. 500M (for gc)",
+    )
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        help="Back up or restore every managed config without any menus",
+    )
+    parser.add_argument(
+        "--yes",
+        "-y",
+        action="store_true",
+        help="Never prompt; use --name or a timestamp for backup names. For add, "
+        "link directories even if .dotfilesignore excludes some of their entries",
+    )
+    parser.add_argument(
+        "--jsonl",
+        action="store_true",
+        help="Print one JSON result per config, with timings, as each finishes "
+        "(for backup/restore; implies --yes)",
+    )
+    parser.add_argument(
+        "--profile",
+        type=str,
+        help="Host profile from profiles.json used to render .tmpl files "
+        "(for restore; defaults to the profile mapped to this hostname)",
+    )
+    parser.add_argument(
+        "--debounce",
+        type=float,
+        default=2.0,
+        help="Seconds to wait for writes to settle before backing up (for watch)",
+    )
+
+    parser.add_argument(
+        "--ssh",
+        type=str,
+        default="ssh",
+        help='Command used to reach the remote host, e.g. "ssh -p 2222" '
+        "(for push/pull)",
+    )
+
+    args = parser.parse_intermixed_args()
+    args.file = args.files[0] if args.files else None
+    if args.files and args.command in ("list", "gc", "doctor", "watch"):
+        print(f"Error: {args.command} doesn't take file arguments")
+        return 1
+    if len(args.files) > 1 and args.from_backup:
+        print("Error: --from-backup restores a single config")
+        return 1
+    # Batch mode never prompts and reports one result per config
+    batch = (
+        args.all or args.jsonl or args.yes or len(args.files) > 1
+    ) and not args.from_backup
+    if (args.jsonl or args.yes) and not (args.all or args.files):
+        if args.command in ("backup", "restore"):
+            print("Error: Please specify configs or --all when not prompting")
+            return 1
+
+    manager = DotfileManager(
+        args.repo,
+        backup_format=args.format or ("dedup" if args.command == "watch" else "dir"),
+        incremental=args.incremental,
+        copy_mode=args.copy_mode,
+        profile=args.profile,
+    )
+    manager.setup_directories()
+    # Read-only commands leave an interrupted batch for the next write to fix
+    if args.command not in ("list", "diff") and not (
+        args.command == "doctor" and not args.fix
+    ):
+        manager.recover_journal()
+
+    try:
+        if args.command == "add":
+            if not args.files:
+                print("Error: Please specify a file or directory to add")
+                return 1
+            if not manager.add_dotfiles(args.files, drop_ignored=args.yes):
+                return 1
+
+        elif args.command == "restore":
+            if batch:
+                failed = report_batch(
+                    manager.restore_batch(
+                        args.files or None,
+                        jobs=args.jobs or 1,
+                        dry_run=args.dry_run,
+                    ),
+                    jsonl=args.jsonl,
+                )
+                return 1 if failed else 0
+            if args.file:
+                manager.restore_dotfile(
+                    args.file, dry_run=args.dry_run, from_backup=args.from_backup
+                )
+            else:
+                choice = show_operation_menu(manager, "restore")
+                if choice == "Restore all":
+                    manager.restore_all(jobs=args.jobs or 1, dry_run=args.dry_run)
+                elif choice == "Select specific config to restore":
+                    config = prompt_for_config(
+                        manager, "Select configuration to restore"
+                    )
+                    if config:
+                        manager.restore_dotfile(config, dry_run=args.dry_run)
+
+        elif args.command == "backup":
+            if batch:
+                failed = report_batch(
+                    manager.backup_batch(
+                        args.files or None,
+                        backup_name=args.name,
+                        jobs=args.jobs or 1,
+                    ),
+                    jsonl=args.jsonl,
+                )
+                return 1 if failed else 0
+            if args.file:
+                manager.create_backup(args.file, args.name)
+            else:
+                choice = show_operation_menu(manager, "backup")
+                if choice == "Backup all":
+                    manager.backup_all(jobs=args.jobs or 1)
+                elif choice == "Select specific config to backup":
+                    config = prompt_for_config(
+                        manager, "Select configuration to backup"
+                    )
+                    if config:
+                        import inquirer
+
+                        try:
+                            questions = [
+                                inquirer.Text(
+                                    "backup_name",
+                                    message="Enter backup name (press Enter for timestamp)",
+                                )
+                            ]
+                            answers = inquirer.prompt(questions)
+                            if answers is None:  # User pressed Esc
+                                print("\nOperation cancelled by user")
+                                return 0
+                            backup_name = (
+                                answers.get("backup_name") if answers else None
+                            )
+                            manager.create_backup(config, backup_name)
+                        except KeyboardInterrupt:
+                            handle_keyboard_interrupt()
+
+        elif args.command == "list":
+            manager.list_dotfiles(
+                depth=args.depth,
+                only_broken=args.only_broken,
+                only_unlinked=args.only_unlinked,
+                as_json=args.json,
+            )
+
+        elif args.command == "doctor":
+            if manager.doctor(fix=args.fix, jobs=args.jobs or 8):
+                return 1
+
+        elif args.command == "diff":
+            if not args.files or len(args.files) > 2:
+                print("Error: Please specify one or two backups to compare")
+                return 1
+            if manager.diff(*args.files):
+                return 1
+
+        elif args.command == "watch":
+            manager.watch(debounce=args.debounce)
+
+        elif args.command in ("push", "pull"):
+            if len(args.files) != 1:
+                print(f"Error: Please specify where to {args.command}: host:path")
+                return 1
+            manager.sync(args.file, args.command, ssh=args.ssh)
+
+        elif args.command == "gc":
+            manager.collect_garbage(
+                keep_last=args.keep_last,
+                keep_daily=args.keep_daily,
+                keep_weekly=args.keep_weekly,
+                max_bytes=args.max_size,
+                dry_run=args.dry_run,
+            )
+
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return 1
+
+    return 0
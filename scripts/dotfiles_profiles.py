@@ -0,0 +1,255 @@
+"""Per-host profiles and template rendering for managed dotfiles.
+
+``profiles.json`` in the repository root defines named sets of variables and
+which profile each host uses::
+
+    {
+        "profiles": {
+            "default": {"email": "me@example.com", "font_size": 11},
+            "laptop": {"extends": "default", "font_size": 14}
+        },
+        "hosts": {"thinkpad": "laptop"}
+    }
+
+Any managed file ending in ``.tmpl`` is a template. It is rendered next to
+itself without the suffix (``.gitconfig.tmpl`` -> ``.gitconfig``) and the
+rendered file is what gets linked into home. Templates substitute
+``{{ name }}`` and support ``{% if name %}``/``{% if not name %}``,
+``{% else %}`` and ``{% endif %}`` on lines of their own.
+
+Rendering is cached by (template hash, variables hash) in a small index, so a
+restore only re-renders templates whose source or variables changed, or whose
+output was modified or deleted.
+"""
+
+import json
+import os
+import re
+import sys
+from pathlib import Path
+
+PROFILES_FILE = "profiles.json"
+TEMPLATE_SUFFIX = ".tmpl"
+RENDER_CACHE_VERSION = 1
+
+VARIABLE_RE = re.compile(r"\{\{\s*([A-Za-z_][\w.]*)\s*\}\}")
+DIRECTIVE_RE = re.compile(r"^\s*\{%\s*(if|else|endif)\b\s*(not\s+)?([\w.]*)\s*%\}\s*$")
+
+
+def load_profile(path, name=None):
+    """Load the variables of a profile.
+
+    The profile is ``name`` if given, else the one mapped to this host, else
+    ``default``. Built-in variables (``hostname``, ``profile``, ``user``,
+    ``home``, ``platform``) can be overridden by the profile.
+
+    Returns:
+        tuple: (profile name, variables dict)
+    """
+    import getpass
+    import socket
+
+    hostname = socket.gethostname()
+    try:
+        with open(path, "r") as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        config = {}
+
+    profiles = config.get("profiles", {})
+    if name is None:
+        name = config.get("hosts", {}).get(hostname, "default")
+    if name not in profiles and (name != "default" or profiles):
+        raise ValueError(f"Unknown profile '{name}' in {path}")
+
+    chain = []
+    current = name
+    while current is not None:
+        if current in chain:
+            raise ValueError(f"Profile '{current}' extends itself in {path}")
+        chain.append(current)
+        current = profiles.get(current, {}).get("extends")
+
+    variables = {
+        "hostname": hostname,
+        "profile": name,
+        "user": getpass.getuser(),
+        "home": str(Path.home()),
+        "platform": sys.platform,
+    }
+    for profile in reversed(chain):
+        if profile not in profiles and profile != "default":
+            raise ValueError(f"Unknown profile '{profile}' in {path}")
+        variables.update(
+            (key, value)
+            for key, value in profiles.get(profile, {}).items()
+            if key != "extends"
+        )
+    return name, variables
+
+
+def hash_bytes(data):
+    # Imported here so that restores without templates never load hashlib
+    import hashlib
+
+    return hashlib.blake2b(data, digest_size=32).hexdigest()
+
+
+def hash_variables(variables):
+    return hash_bytes(json.dumps(variables, sort_keys=True).encode())
+
+
+class Template:
+    """A template compiled into a list of text, variable and branch nodes."""
+
+    def __init__(self, source, name="<template>"):
+        self.name = name
+        self.nodes = self._compile(source.splitlines(keepends=True))
+
+    def _compile(self, lines):
+        root = []
+        # Stack of (node list being filled, open if-node or None)
+        stack = [(root, None)]
+        for number, line in enumerate(lines, 1):
+            directive = DIRECTIVE_RE.match(line)
+            if directive is None:
+                parts = VARIABLE_RE.split(line)
+                nodes = stack[-1][0]
+                for i, part in enumerate(parts):
+                    if i % 2:
+                        nodes.append(("var", part))
+                    elif part:
+                        nodes.append(("text", part))
+                continue
+
+            keyword, negated, variable = directive.groups()
+            if keyword == "if":
+                if not variable:
+                    raise ValueError(f"{self.name}:{number}: if without a variable")
+                node = ("if", variable, bool(negated), [], [])
+                stack[-1][0].append(node)
+                stack.append((node[3], node))
+            elif stack[-1][1] is None:
+                raise ValueError(f"{self.name}:{number}: {keyword} without if")
+            elif keyword == "else":
+                node = stack.pop()[1]
+                stack.append((node[4], node))
+            else:
+                stack.pop()
+        if len(stack) > 1:
+            raise ValueError(f"{self.name}: unclosed if block")
+        return root
+
+    def render(self, variables):
+        out = []
+        self._render(self.nodes, variables, out)
+        return "".join(out)
+
+    def _lookup(self, variables, name):
+        value = variables
+        for key in name.split("."):
+            try:
+                value = value[key]
+            except (KeyError, TypeError):
+                raise ValueError(f"{self.name}: undefined variable '{name}'")
+        return value
+
+    def _render(self, nodes, variables, out):
+        for node in nodes:
+            if node[0] == "text":
+                out.append(node[1])
+            elif node[0] == "var":
+                out.append(str(self._lookup(variables, node[1])))
+            else:
+                _, name, negated, then_nodes, else_nodes = node
+                try:
+                    value = bool(self._lookup(variables, name))
+                except ValueError:
+                    value = False
+                branch = then_nodes if value != negated else else_nodes
+                self._render(branch, variables, out)
+
+
+class TemplateRenderer:
+    """Render templates below ``root``, skipping those whose inputs are unchanged."""
+
+    def __init__(self, root, cache_path, variables):
+        self.root = Path(root)
+        self.cache_path = Path(cache_path)
+        self.variables = variables
+        self.variables_hash = hash_variables(variables)
+
+    def _load(self):
+        try:
+            with open(self.cache_path, "r") as f:
+                data = json.load(f)
+            if data.get("version") == RENDER_CACHE_VERSION:
+                return data["templates"]
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError) as e:
+            print(f"Ignoring unreadable render cache {self.cache_path}: {e}")
+        return {}
+
+    def _save(self, templates):
+        tmp_path = self.cache_path.with_name(f".{self.cache_path.name}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {"version": RENDER_CACHE_VERSION, "templates": templates},
+                f,
+                separators=(",", ":"),
+            )
+        os.replace(tmp_path, self.cache_path)
+
+    def render_all(self, templates, dry_run=False):
+        """Render every template whose source, variables or output changed.
+
+        Args:
+            templates (list): Template paths relative to the root
+            dry_run (bool): Only report what would be rendered
+
+        Returns:
+            list: (template, output, status) with status "rendered" or "unchanged"
+        """
+        cache = self._load()
+        updated = {}
+        results = []
+
+        for template in templates:
+            source = self.root / template
+            output = source.with_name(source.name[: -len(TEMPLATE_SUFFIX)])
+            data = source.read_bytes()
+            record = {"template": hash_bytes(data), "variables": self.variables_hash}
+
+            cached = cache.get(template)
+            try:
+                st = output.lstat()
+                output_sig = [st.st_size, st.st_mtime_ns]
+            except FileNotFoundError:
+                output_sig = None
+            if (
+                cached is not None
+                and cached["template"] == record["template"]
+                and cached["variables"] == record["variables"]
+                and cached["output"] == output_sig
+            ):
+                updated[template] = cached
+                results.append((template, output, "unchanged"))
+                continue
+
+            results.append((template, output, "rendered"))
+            if dry_run:
+                continue
+            text = Template(data.decode("utf-8"), template).render(self.variables)
+            tmp_path = output.with_name(f".{output.name}.render")
+            with open(tmp_path, "w") as f:
+                f.write(text)
+            os.chmod(tmp_path, os.stat(source).st_mode & 0o7777)
+            os.replace(tmp_path, output)
+            st = output.lstat()
+            record["output"] = [st.st_size, st.st_mtime_ns]
+            updated[template] = record
+
+        if not dry_run and updated != cache:
+            self._save(updated)
+        return results
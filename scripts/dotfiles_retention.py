@@ -0,0 +1,183 @@
+"""Retention policies for timestamped dotfile backups.
+
+Backups are recognised by the ``<name>_<YYYYmmdd_HHMMSS>`` naming used by the
+dotfile manager, optionally followed by a manifest or archive suffix. Backups
+with a custom name are never selected for removal.
+"""
+
+import os
+import re
+from pathlib import Path
+
+from dotfiles_store import MANIFEST_SUFFIX
+
+BACKUP_NAME_RE = re.compile(
+    r"^(?P<name>.+)_(?P<stamp>\d{8}_\d{6})"
+    r"(?P<suffix>\.manifest\.json|\.tar\.zst|\.tar\.xz)?$"
+)
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+
+def parse_size(value):
+    """Parse a size such as ``500M`` or ``2G`` into bytes."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*", value.upper())
+    if not match:
+        raise ValueError(f"Invalid size: {value}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+
+def format_size(size):
+    for unit in ["B", "K", "M", "G"]:
+        if size < 1024:
+            return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+        size /= 1024
+    return f"{size:.1f}T"
+
+
+def parse_backup_name(relative_path):
+    """Split a backup path into its config name and timestamp.
+
+    Returns:
+        tuple: (config_name, datetime, suffix), or None for custom-named backups
+    """
+    import datetime
+
+    path = Path(relative_path)
+    match = BACKUP_NAME_RE.match(path.name)
+    if not match:
+        return None
+    try:
+        created = datetime.datetime.strptime(match["stamp"], "%Y%m%d_%H%M%S")
+    except ValueError:
+        return None
+    config = (path.parent / match["name"]).as_posix()
+    return config, created, match["suffix"] or ""
+
+
+def find_backups(backup_dir):
+    """Find every timestamped backup below ``backup_dir``.
+
+    Directories that are not backups themselves are searched recursively, which
+    covers nested configs such as ``.config/nvim_<timestamp>``.
+
+    Returns:
+        list: Backups as dicts with ``path``, ``config``, ``created`` and ``suffix``
+    """
+    backup_dir = Path(backup_dir)
+    backups = []
+    pending = [backup_dir]
+    while pending:
+        directory = pending.pop()
+        with os.scandir(directory) as it:
+            for entry in it:
+                if directory == backup_dir and entry.name == ".store":
+                    continue
+                relative = Path(entry.path).relative_to(backup_dir)
+                parsed = parse_backup_name(relative)
+                if parsed:
+                    config, created, suffix = parsed
+                    backups.append(
+                        {
+                            "path": Path(entry.path),
+                            "config": config,
+                            "created": created,
+                            "suffix": suffix,
+                        }
+                    )
+                elif entry.is_dir(follow_symlinks=False):
+                    pending.append(Path(entry.path))
+    return backups
+
+
+def select_backups(backups, keep_last=None, keep_daily=None, keep_weekly=None):
+    """Apply count and calendar bucket policies to the backups of one config.
+
+    A backup is kept when any policy selects it: one of the ``keep_last``
+    newest, or the newest backup of one of the ``keep_daily`` most recent days
+    or ``keep_weekly`` most recent ISO weeks that have backups. Without any
+    policy everything is kept.
+
+    Returns:
+        set: Paths of the backups to keep
+    """
+    ordered = sorted(backups, key=lambda b: b["created"], reverse=True)
+    if keep_last is None and keep_daily is None and keep_weekly is None:
+        return {b["path"] for b in ordered}
+
+    keep = {b["path"] for b in ordered[: keep_last or 0]}
+    for count, bucket in [
+        (keep_daily, lambda created: created.date()),
+        (keep_weekly, lambda created: created.isocalendar()[:2]),
+    ]:
+        if not count:
+            continue
+        seen = set()
+        for backup in ordered:
+            key = bucket(backup["created"])
+            if key in seen:
+                continue
+            if len(seen) == count:
+                break
+            seen.add(key)
+            keep.add(backup["path"])
+    return keep
+
+
+def backup_sizes(backups, store):
+    """Estimate the disk space each backup would free when removed.
+
+    Backups are processed newest first and content shared with a newer backup
+    (hardlinked files, deduplicated objects) is only counted once, for the
+    newer backup, so removing older backups frees roughly the size given here.
+
+    Returns:
+        dict: Size in bytes per backup path
+    """
+    seen_inodes = set()
+    seen_objects = set()
+    sizes = {}
+
+    for backup in sorted(backups, key=lambda b: b["created"], reverse=True):
+        path = backup["path"]
+        size = path.lstat().st_size
+        if backup["suffix"] == MANIFEST_SUFFIX:
+            for entry in store.read_manifest(path)["entries"]:
+                if entry["type"] == "file" and entry["hash"] not in seen_objects:
+                    seen_objects.add(entry["hash"])
+                    size += entry["size"]
+        elif path.is_dir() and not path.is_symlink():
+            size = 0
+            for dirpath, _, filenames in os.walk(path):
+                for name in filenames:
+                    st = os.lstat(os.path.join(dirpath, name))
+                    if (st.st_dev, st.st_ino) not in seen_inodes:
+                        seen_inodes.add((st.st_dev, st.st_ino))
+                        size += st.st_size
+        sizes[path] = size
+    return sizes
+
+
+def trim_to_size(backups, keep, sizes, max_bytes):
+    """Drop the oldest kept backups until the total size fits in ``max_bytes``.
+
+    The newest backup of every config is always kept.
+
+    Returns:
+        set: The reduced set of paths to keep
+    """
+    keep = set(keep)
+    newest = {}
+    for backup in backups:
+        current = newest.get(backup["config"])
+        if current is None or backup["created"] > current["created"]:
+            newest[backup["config"]] = backup
+    protected = {backup["path"] for backup in newest.values()}
+
+    total = sum(sizes[path] for path in keep)
+    for backup in sorted(backups, key=lambda b: b["created"]):
+        if total <= max_bytes:
+            break
+        if backup["path"] in keep and backup["path"] not in protected:
+            keep.discard(backup["path"])
+            total -= sizes[backup["path"]]
+    return keep
@@ -0,0 +1,498 @@
+"""Backup storage formats for the dotfile manager.
+
+The content-addressed store writes file contents once into ``.store/objects``
+keyed by their hash and records every backup as a small JSON manifest that
+points at those objects, so backing up an unchanged tree again only costs a
+walk and a manifest. Backups can also be streamed into compressed tar archives.
+"""
+
+import json
+import os
+import shutil
+import stat
+import threading
+import time
+from pathlib import Path
+
+from dotfiles_copy import fast_copy, fast_copy_data
+
+HASH_ALGORITHM = "blake2b-256"
+MANIFEST_SUFFIX = ".manifest.json"
+MANIFEST_VERSION = 1
+INDEX_VERSION = 1
+ARCHIVE_FORMATS = ["tar.zst", "tar.xz"]
+
+
+def new_hash():
+    # hashlib is imported on first use; commands that never hash (list,
+    # restore, doctor) don't pay for loading OpenSSL
+    import hashlib
+
+    return hashlib.blake2b(digest_size=32)
+
+
+def hash_file(path):
+    """Return the hex digest of a file's contents."""
+    import hashlib
+
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, new_hash).hexdigest()
+
+
+def copy_and_hash(src, dst):
+    """Copy a file with its metadata and return the hash of the copy.
+
+    The copy is reflinked or done in the kernel where possible, so the only
+    pass over the data in user space is hashing the copy that was written.
+    """
+    fast_copy(src, dst)
+    return hash_file(dst)
+
+
+def entry_path(root, relative):
+    """Join a manifest entry path onto ``root`` ("." is the root itself)."""
+    return Path(root) if relative == "." else Path(root, relative)
+
+
+def is_manifest(path):
+    """Check whether a backup path is a dedup manifest."""
+    return str(path).endswith(MANIFEST_SUFFIX)
+
+
+def archive_format(path):
+    """Get the archive format of a backup path, or None if it isn't an archive."""
+    for fmt in ARCHIVE_FORMATS:
+        if str(path).endswith("." + fmt):
+            return fmt
+    return None
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError(
+            "tar.zst backups need the 'zstandard' package (pixi add zstandard)"
+        ) from None
+    return zstandard
+
+
+def write_archive(source, archive_path, fmt, ignore=None):
+    """Stream a file or directory into a compressed tar archive.
+
+    The tree is compressed while it is read, so nothing is staged on disk apart
+    from the archive itself.
+
+    Args:
+        source (Path): File or directory to archive. A symlinked root is followed
+        archive_path (Path): Archive to create
+        fmt (str): One of ``ARCHIVE_FORMATS``
+        ignore (callable, optional): ``ignore(relative, is_dir)`` for entries to
+            leave out; excluded directories are not descended into
+
+    Returns:
+        Path: The archive path
+    """
+    import tarfile
+
+    archive_path = Path(archive_path)
+    root = os.path.realpath(source)
+    arcname = Path(source).name
+
+    def exclude(tarinfo):
+        relative = tarinfo.name.partition("/")[2]
+        if relative and ignore(relative, tarinfo.isdir()):
+            return None
+        return tarinfo
+
+    tar_filter = exclude if ignore else None
+    tmp_path = archive_path.with_name(f".{archive_path.name}.tmp")
+    try:
+        if fmt == "tar.xz":
+            with tarfile.open(tmp_path, "w|xz") as tar:
+                tar.add(root, arcname=arcname, filter=tar_filter)
+        else:
+            compressor = _zstandard().ZstdCompressor(threads=-1)
+            with open(tmp_path, "wb") as raw:
+                with compressor.stream_writer(raw, closefd=False) as compressed:
+                    with tarfile.open(fileobj=compressed, mode="w|") as tar:
+                        tar.add(root, arcname=arcname, filter=tar_filter)
+        os.replace(tmp_path, archive_path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+    return archive_path
+
+
+def extract_archive(archive_path, destination):
+    """Stream the backed up tree out of an archive into ``destination``.
+
+    ``destination`` must not exist yet; the archive's root entry is recreated
+    under that name.
+    """
+    import tarfile
+
+    destination = Path(destination)
+    staging = destination.with_name(f".{destination.name}.extract")
+    if staging.exists():
+        shutil.rmtree(staging)
+    staging.mkdir(parents=True)
+
+    def extract_members(tar):
+        root = None
+        for member in tar:
+            if root is None:
+                root = member.name.split("/", 1)[0]
+            tar.extract(member, staging, filter="tar")
+        return root
+
+    try:
+        if archive_format(archive_path) == "tar.xz":
+            with tarfile.open(archive_path, "r|xz") as tar:
+                root = extract_members(tar)
+        else:
+            decompressor = _zstandard().ZstdDecompressor()
+            with open(archive_path, "rb") as raw:
+                with decompressor.stream_reader(raw) as decompressed:
+                    with tarfile.open(fileobj=decompressed, mode="r|") as tar:
+                        root = extract_members(tar)
+        if root is None:
+            raise ValueError(f"Archive {archive_path} is empty")
+        os.replace(staging / root, destination)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return destination
+
+
+class BackupStore:
+    def __init__(self, backup_dir):
+        self.backup_dir = Path(backup_dir)
+        self.store_dir = self.backup_dir / ".store"
+        self.objects_dir = self.store_dir / "objects"
+
+    def object_path(self, digest):
+        """Get the on-disk location of an object."""
+        return self.objects_dir / digest[:2] / digest[2:]
+
+    def put_file(self, path, digest=None):
+        """Store a file's contents and return its digest.
+
+        Contents are only copied when no object with the same hash exists yet.
+        """
+        if digest is None:
+            digest = hash_file(path)
+        object_path = self.object_path(digest)
+        if object_path.exists():
+            return digest
+
+        object_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = object_path.with_name(
+            f".{object_path.name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        )
+        try:
+            fast_copy_data(path, tmp_path)
+            os.chmod(tmp_path, 0o444)
+            os.replace(tmp_path, object_path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+        return digest
+
+    def scan(self, source, ignore=None):
+        """Walk a file or directory and describe every entry in it.
+
+        Args:
+            source (Path): File or directory to walk
+            ignore (callable, optional): ``ignore(relative, is_dir)`` for entries
+                to leave out; excluded directories are not descended into
+
+        Returns:
+            list: Entries with ``path`` relative to ``source`` ("." for the root).
+        """
+        source = Path(source)
+        root_stat = source.stat()
+        if not stat.S_ISDIR(root_stat.st_mode):
+            return [self._describe(".", source, root_stat)]
+
+        entries = [self._describe(".", source, root_stat)]
+        for dirpath, dirnames, filenames in os.walk(source):
+            current = Path(dirpath)
+            prefix = current.relative_to(source).as_posix()
+            prefix = "" if prefix == "." else prefix + "/"
+            if ignore is not None:
+                dirnames[:] = [d for d in dirnames if not ignore(prefix + d, True)]
+                filenames = [f for f in filenames if not ignore(prefix + f, False)]
+            dirnames.sort()
+            for name in dirnames + sorted(filenames):
+                path = current / name
+                entries.append(self._describe(prefix + name, path, path.lstat()))
+        return entries
+
+    def _describe(self, relative, path, st):
+        entry = {
+            "path": relative,
+            "mode": stat.S_IMODE(st.st_mode),
+            "mtime_ns": st.st_mtime_ns,
+        }
+        if stat.S_ISLNK(st.st_mode):
+            entry["type"] = "symlink"
+            entry["target"] = os.readlink(path)
+        elif stat.S_ISDIR(st.st_mode):
+            entry["type"] = "dir"
+        else:
+            entry["type"] = "file"
+            entry["size"] = st.st_size
+            entry["ino"] = st.st_ino
+        return entry
+
+    def write_backup(self, source, manifest_path, entries=None, ignore=None):
+        """Back up ``source`` into the store and write its manifest.
+
+        Args:
+            source (Path): File or directory to back up
+            manifest_path (Path): Where to write the manifest
+            entries (list, optional): Pre-scanned entries. Files that already
+                carry a hash are not read again unless their object is missing
+            ignore (callable, optional): Entries to leave out, see ``scan``
+
+        Returns:
+            Path: The manifest path
+        """
+        if entries is None:
+            entries = self.scan(source, ignore)
+        for entry in entries:
+            if entry["type"] == "file":
+                entry["hash"] = self.put_file(
+                    entry_path(source, entry["path"]), entry.get("hash")
+                )
+
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "algorithm": HASH_ALGORITHM,
+            "source": str(source),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "entries": entries,
+        }
+        manifest_path = Path(manifest_path)
+        manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = manifest_path.with_name(f".{manifest_path.name}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f, separators=(",", ":"))
+        os.replace(tmp_path, manifest_path)
+        return manifest_path
+
+    def read_manifest(self, manifest_path):
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != MANIFEST_VERSION:
+            raise ValueError(f"Unsupported manifest version in {manifest_path}")
+        return manifest
+
+    def find_manifests(self):
+        """Find every manifest in the backup directory."""
+        manifests = []
+        for dirpath, dirnames, filenames in os.walk(self.backup_dir):
+            if Path(dirpath) == self.backup_dir and ".store" in dirnames:
+                dirnames.remove(".store")
+            manifests.extend(
+                Path(dirpath, name) for name in filenames if is_manifest(name)
+            )
+        return manifests
+
+    def referenced_objects(self, manifest_paths):
+        """Collect every object digest referenced by the given manifests."""
+        referenced = set()
+        for manifest_path in manifest_paths:
+            for entry in self.read_manifest(manifest_path)["entries"]:
+                if entry["type"] == "file":
+                    referenced.add(entry["hash"])
+        return referenced
+
+    def prune_objects(self, referenced, dry_run=False):
+        """Delete objects that no manifest references any more.
+
+        Returns:
+            tuple: (number of objects, bytes) removed or, for a dry run, removable
+        """
+        removed = 0
+        freed = 0
+        if not self.objects_dir.exists():
+            return removed, freed
+        for prefix in sorted(self.objects_dir.iterdir()):
+            if not prefix.is_dir():
+                continue
+            with os.scandir(prefix) as it:
+                for entry in it:
+                    # Skip objects that are still being written
+                    if entry.name.startswith("."):
+                        continue
+                    if prefix.name + entry.name in referenced:
+                        continue
+                    freed += entry.stat().st_size
+                    removed += 1
+                    if not dry_run:
+                        os.unlink(entry.path)
+        return removed, freed
+
+    def extract(self, manifest_path, destination):
+        """Recreate a backed up file or directory tree at ``destination``."""
+        manifest = self.read_manifest(manifest_path)
+        destination = Path(destination)
+        directories = []
+
+        for entry in manifest["entries"]:
+            target = entry_path(destination, entry["path"])
+            if entry["type"] == "dir":
+                target.mkdir(parents=True, exist_ok=True)
+                directories.append((target, entry))
+                continue
+
+            target.parent.mkdir(parents=True, exist_ok=True)
+            if entry["type"] == "symlink":
+                os.symlink(entry["target"], target)
+                continue
+
+            fast_copy_data(self.object_path(entry["hash"]), target)
+            os.chmod(target, entry["mode"])
+            os.utime(target, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+
+        # Apply directory metadata last so creating children doesn't touch it
+        for target, entry in reversed(directories):
+            os.chmod(target, entry["mode"])
+            os.utime(target, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+        return destination
+
+
+def entry_signature(entry):
+    """Compact form of an entry as stored in the backup index."""
+    if entry["type"] == "file":
+        return [
+            "file",
+            entry["size"],
+            entry["mtime_ns"],
+            entry["ino"],
+            entry.get("hash"),
+        ]
+    if entry["type"] == "symlink":
+        return ["symlink", entry["target"]]
+    return ["dir"]
+
+
+def find_changes(source, entries, record):
+    """Compare scanned entries against the index record of the previous backup.
+
+    Files whose size, mtime and inode all match the record reuse its hash
+    without being read. When the metadata is ambiguous (same size but a
+    different mtime or inode, or an mtime too close to the previous scan to
+    trust) the file is hashed and compared instead.
+
+    Args:
+        source (Path): Root the entries were scanned from
+        entries (list): Entries returned by ``BackupStore.scan``
+        record (dict): Index record of the previous backup, or None
+
+    Returns:
+        set: Relative paths that were added, removed or modified
+    """
+    previous = record["entries"] if record else {}
+    changed = set(previous) - {entry["path"] for entry in entries}
+
+    for entry in entries:
+        old = previous.get(entry["path"])
+        if old is None or old[0] != entry["type"]:
+            changed.add(entry["path"])
+        elif entry["type"] == "symlink":
+            if old[1] != entry["target"]:
+                changed.add(entry["path"])
+        elif entry["type"] == "file":
+            _, size, mtime_ns, ino, digest = old
+            if size != entry["size"]:
+                changed.add(entry["path"])
+                continue
+            racy = entry["mtime_ns"] >= record["scanned_ns"]
+            if mtime_ns == entry["mtime_ns"] and ino == entry["ino"] and not racy:
+                if digest is not None:
+                    entry["hash"] = digest
+                continue
+            if digest is None:
+                # Backups that don't hash their contents can't be compared
+                changed.add(entry["path"])
+                continue
+            entry["hash"] = hash_file(entry_path(source, entry["path"]))
+            if entry["hash"] != digest:
+                changed.add(entry["path"])
+    return changed
+
+
+class BackupIndex:
+    """Persisted metadata of what the last backup of each config contained.
+
+    Updates are thread-safe and only written back by ``save`` when a record
+    actually changed.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._records = None
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._records is not None:
+            return self._records
+        self._records = {}
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            if data.get("version") == INDEX_VERSION:
+                self._records = data["configs"]
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError) as e:
+            print(f"Ignoring unreadable backup index {self.path}: {e}")
+        return self._records
+
+    def get(self, config_name):
+        with self._lock:
+            return self._load().get(config_name)
+
+    def update(self, config_name, backup_path, scanned_ns, entries):
+        signatures = {entry["path"]: entry_signature(entry) for entry in entries}
+        with self._lock:
+            records = self._load()
+            old = records.get(config_name)
+            if (
+                old is not None
+                and old["backup"] == str(backup_path)
+                and old["entries"] == signatures
+            ):
+                # A newer scan time only matters to files it no longer marks
+                # as racy, which would otherwise be hashed on every backup
+                if any(
+                    signature[0] == "file" and signature[2] >= old["scanned_ns"]
+                    for signature in signatures.values()
+                ):
+                    old["scanned_ns"] = scanned_ns
+                    self._dirty = True
+                return
+            records[config_name] = {
+                "backup": str(backup_path),
+                "scanned_ns": scanned_ns,
+                "entries": signatures,
+            }
+            self._dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(
+                    {"version": INDEX_VERSION, "configs": self._records},
+                    f,
+                    separators=(",", ":"),
+                )
+            os.replace(tmp_path, self.path)
+            self._dirty = False
@@ -0,0 +1,199 @@
+"""Watch the dotfiles directory for changes with inotify.
+
+inotify is used directly through ``ctypes`` so no extra dependency is needed.
+It only watches single directories, so every directory in the tree gets its
+own watch and new directories are added as they appear. Changes are collected
+until the tree has been quiet for a moment, which folds an editor's
+write-temp-then-rename save into a single change.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+WATCH_MASK = (
+    IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_ONLYDIR
+    | IN_DONT_FOLLOW
+    | IN_EXCL_UNLINK
+)
+
+# struct inotify_event: int wd; uint32_t mask, cookie, len; char name[len]
+EVENT_HEADER = struct.Struct("iIII")
+# Marker for "anything may have changed" after the kernel queue overflowed
+ALL_CHANGED = "."
+
+
+class Inotify:
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        try:
+            self._add_watch = libc.inotify_add_watch
+            self._rm_watch = libc.inotify_rm_watch
+            init = libc.inotify_init1
+        except AttributeError:
+            raise OSError("inotify is not available on this platform")
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+
+        self.fd = init(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1 failed: {os.strerror(err)}")
+
+    def fileno(self):
+        return self.fd
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), str(path))
+        return wd
+
+    def rm_watch(self, wd):
+        self._rm_watch(self.fd, wd)
+
+    def read_events(self):
+        """Read all queued events as (wd, mask, cookie, name) tuples."""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset : offset + length].rstrip(b"\0")
+                offset += length
+                events.append((wd, mask, cookie, os.fsdecode(name)))
+
+    def close(self):
+        os.close(self.fd)
+
+
+class TreeWatcher:
+    """Recursively watch a directory tree and report changed paths."""
+
+    def __init__(self, root):
+        self.root = str(root)
+        self.inotify = Inotify()
+        self.watches = {}  # wd -> directory relative to the root ("" for root)
+        self.add_tree("")
+
+    def _join(self, directory, name):
+        return f"{directory}/{name}" if directory else name
+
+    def add_tree(self, relative):
+        """Watch a directory and everything below it.
+
+        Returns:
+            set: Files found in the tree, which count as changed when the
+            directory was created or moved in after watching started
+        """
+        files = set()
+        top = os.path.join(self.root, relative) if relative else self.root
+        for dirpath, dirnames, filenames in os.walk(top):
+            directory = os.path.relpath(dirpath, self.root)
+            directory = "" if directory == "." else directory
+            try:
+                wd = self.inotify.add_watch(dirpath)
+            except FileNotFoundError:
+                dirnames[:] = []
+                continue
+            self.watches[wd] = directory
+            files.update(self._join(directory, name) for name in filenames)
+        return files
+
+    def remove_tree(self, relative):
+        prefix = relative + "/"
+        for wd, directory in list(self.watches.items()):
+            if directory == relative or directory.startswith(prefix):
+                self.inotify.rm_watch(wd)
+                del self.watches[wd]
+
+    def read_changes(self):
+        """Process queued events and return the relative paths they touched."""
+        changed = set()
+        for wd, mask, _, name in self.inotify.read_events():
+            if mask & IN_Q_OVERFLOW:
+                changed.add(ALL_CHANGED)
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+            directory = self.watches.get(wd)
+            if directory is None or not name:
+                continue
+
+            path = self._join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    changed.update(self.add_tree(path))
+                elif mask & IN_MOVED_FROM:
+                    self.remove_tree(path)
+            else:
+                changed.add(path)
+        return changed
+
+    def close(self):
+        self.inotify.close()
+
+
+def watch_changes(root, debounce=2.0, max_delay=30.0):
+    """Yield sets of changed paths below ``root`` once bursts of writes settle.
+
+    A batch is emitted after ``debounce`` seconds without further events, or at
+    the latest ``max_delay`` seconds after its first event so a file that is
+    written continuously still gets backed up.
+    """
+    watcher = TreeWatcher(root)
+    pending = set()
+    first = last = None
+    try:
+        while True:
+            timeout = None
+            if pending:
+                deadline = min(last + debounce, first + max_delay)
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    yield pending
+                    pending = set()
+                    first = last = None
+                    continue
+
+            ready, _, _ = select.select([watcher.inotify], [], [], timeout)
+            if ready:
+                changes = watcher.read_changes()
+                if changes:
+                    now = time.monotonic()
+                    pending |= changes
+                    first = first or now
+                    last = now
+    finally:
+        watcher.close()
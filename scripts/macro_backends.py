@@ -0,0 +1,291 @@
+import time
+from abc import ABC, abstractmethod
+
+# Keys stored by name in macros (``"is_special": true``)
+SPECIAL_KEYS = [
+    "enter",
+    "space",
+    "backspace",
+    "delete",
+    "tab",
+    "shift",
+    "ctrl",
+    "alt",
+    "caps_lock",
+    "esc",
+    "up",
+    "down",
+    "left",
+    "right",
+]
+
+
+class InputBackend(ABC):
+    """Where played back mouse and keyboard actions are sent.
+
+    Buttons and keys are resolved once from their names in the macro with
+    ``resolve_button``/``resolve_key``, which raise ValueError for names the
+    backend can't send; the press/release methods take the resolved values.
+    """
+
+    name = None
+
+    @property
+    @abstractmethod
+    def position(self):
+        pass
+
+    @abstractmethod
+    def move_to(self, x, y):
+        pass
+
+    def resolve_button(self, name):
+        return name
+
+    def resolve_key(self, name, is_special):
+        return name
+
+    @abstractmethod
+    def press_button(self, button):
+        pass
+
+    @abstractmethod
+    def release_button(self, button):
+        pass
+
+    @abstractmethod
+    def press_key(self, key):
+        pass
+
+    @abstractmethod
+    def release_key(self, key):
+        pass
+
+    def close(self):
+        pass
+
+
+class PynputBackend(InputBackend):
+    """Inject input through pynput's controllers (X11, Windows, macOS)"""
+
+    name = "pynput"
+
+    def __init__(self):
+        from pynput.keyboard import Controller as KeyboardController
+        from pynput.keyboard import Key
+        from pynput.mouse import Button
+        from pynput.mouse import Controller as MouseController
+
+        self.Button = Button
+        self.Key = Key
+        self.mouse_controller = MouseController()
+        self.keyboard_controller = KeyboardController()
+
+    @property
+    def position(self):
+        return self.mouse_controller.position
+
+    def move_to(self, x, y):
+        self.mouse_controller.position = (x, y)
+
+    def resolve_button(self, name):
+        return self.Button.left if name == "left" else self.Button.right
+
+    def resolve_key(self, name, is_special):
+        if is_special:
+            # Keys outside SPECIAL_KEYS were recorded as "Key.<name>"
+            key = getattr(self.Key, name.removeprefix("Key."), None)
+        else:
+            # Characters are typed one at a time
+            key = name if isinstance(name, str) and len(name) == 1 else None
+        if key is None:
+            raise ValueError(f"The pynput backend can't send key '{name}'")
+        return key
+
+    def press_button(self, button):
+        self.mouse_controller.press(button)
+
+    def release_button(self, button):
+        self.mouse_controller.release(button)
+
+    def press_key(self, key):
+        self.keyboard_controller.press(key)
+
+    def release_key(self, key):
+        self.keyboard_controller.release(key)
+
+
+class UInputBackend(InputBackend):
+    """Inject input through a virtual evdev device (/dev/uinput).
+
+    Works below the display server, so it also drives Wayland sessions and
+    consoles, but needs write access to /dev/uinput. The pointer is absolute
+    over a ``width`` x ``height`` screen. Characters are mapped for a US layout.
+    """
+
+    name = "uinput"
+
+    SPECIAL_CODES = {
+        "enter": "KEY_ENTER",
+        "space": "KEY_SPACE",
+        "backspace": "KEY_BACKSPACE",
+        "delete": "KEY_DELETE",
+        "tab": "KEY_TAB",
+        "shift": "KEY_LEFTSHIFT",
+        "ctrl": "KEY_LEFTCTRL",
+        "alt": "KEY_LEFTALT",
+        "caps_lock": "KEY_CAPSLOCK",
+        "esc": "KEY_ESC",
+        "up": "KEY_UP",
+        "down": "KEY_DOWN",
+        "left": "KEY_LEFT",
+        "right": "KEY_RIGHT",
+    }
+    CHAR_CODES = {
+        " ": "KEY_SPACE",
+        "\n": "KEY_ENTER",
+        "\t": "KEY_TAB",
+        "-": "KEY_MINUS",
+        "=": "KEY_EQUAL",
+        "[": "KEY_LEFTBRACE",
+        "]": "KEY_RIGHTBRACE",
+        ";": "KEY_SEMICOLON",
+        "'": "KEY_APOSTROPHE",
+        "`": "KEY_GRAVE",
+        "\\": "KEY_BACKSLASH",
+        ",": "KEY_COMMA",
+        ".": "KEY_DOT",
+        "/": "KEY_SLASH",
+    }
+    SHIFTED_CHARS = dict(zip('!@#$%^&*()_+{}:"~|<>?', "1234567890-=[];'`\\,./"))
+
+    def __init__(self, width=1920, height=1080):
+        try:
+            from evdev import UInput, ecodes
+        except ImportError:
+            raise RuntimeError(
+                "The uinput backend needs the 'evdev' package (pixi add evdev)"
+            ) from None
+
+        self.ecodes = ecodes
+        # Every key and button code, without the KEY_MAX/KEY_CNT sentinels
+        keys = sorted(code for code in ecodes.keys if code < ecodes.KEY_MAX)
+        self.device = UInput(
+            {
+                ecodes.EV_KEY: keys,
+                ecodes.EV_ABS: [
+                    (ecodes.ABS_X, (0, 0, width - 1, 0, 0, 0)),
+                    (ecodes.ABS_Y, (0, 0, height - 1, 0, 0, 0)),
+                ],
+            },
+            name="macro-recorder",
+        )
+        # uinput can't read the pointer back, so track where it was sent
+        self._position = (0, 0)
+
+    @property
+    def position(self):
+        return self._position
+
+    def move_to(self, x, y):
+        ecodes = self.ecodes
+        self.device.write(ecodes.EV_ABS, ecodes.ABS_X, x)
+        self.device.write(ecodes.EV_ABS, ecodes.ABS_Y, y)
+        self.device.syn()
+        self._position = (x, y)
+
+    def resolve_button(self, name):
+        return self.ecodes.BTN_LEFT if name == "left" else self.ecodes.BTN_RIGHT
+
+    def resolve_key(self, name, is_special):
+        """Returns (key code, whether shift must be held)"""
+        if is_special:
+            code = self.SPECIAL_CODES.get(name, f"KEY_{name.removeprefix('Key.')}")
+            code, shift = code.upper(), False
+        else:
+            shift = name.isupper() or name in self.SHIFTED_CHARS
+            char = self.SHIFTED_CHARS.get(name, name.lower())
+            code = self.CHAR_CODES.get(char, f"KEY_{char.upper()}")
+        try:
+            return self.ecodes.ecodes[code], shift
+        except KeyError:
+            # e.g. Key.cmd or characters outside the US layout
+            raise ValueError(f"The uinput backend can't send key '{name}'") from None
+
+    def _key(self, code, value):
+        self.device.write(self.ecodes.EV_KEY, code, value)
+        self.device.syn()
+
+    def press_button(self, button):
+        self._key(button, 1)
+
+    def release_button(self, button):
+        self._key(button, 0)
+
+    def press_key(self, key):
+        code, shift = key
+        if shift:
+            self._key(self.ecodes.KEY_LEFTSHIFT, 1)
+        self._key(code, 1)
+
+    def release_key(self, key):
+        code, shift = key
+        self._key(code, 0)
+        if shift:
+            self._key(self.ecodes.KEY_LEFTSHIFT, 0)
+
+    def close(self):
+        self.device.close()
+
+
+class RecordingBackend(InputBackend):
+    """Headless backend that only records what would have been injected.
+
+    Every action is appended to ``actions`` as ``(timestamp_ns, action,
+    argument)`` using ``clock`` (the playback scheduler's clock by default),
+    so tests and benchmarks can check what was played and when.
+    """
+
+    name = "recording"
+
+    def __init__(self, clock=time.perf_counter_ns):
+        self.clock = clock
+        self.actions = []
+        self._position = (0, 0)
+
+    @property
+    def position(self):
+        return self._position
+
+    def move_to(self, x, y):
+        self._position = (x, y)
+        self.actions.append((self.clock(), "move", (x, y)))
+
+    def press_button(self, button):
+        self.actions.append((self.clock(), "press_button", button))
+
+    def release_button(self, button):
+        self.actions.append((self.clock(), "release_button", button))
+
+    def press_key(self, key):
+        self.actions.append((self.clock(), "press_key", key))
+
+    def release_key(self, key):
+        self.actions.append((self.clock(), "release_key", key))
+
+
+BACKENDS = {
+    backend.name: backend
+    for backend in [PynputBackend, UInputBackend, RecordingBackend]
+}
+
+
+def create_backend(name, **options):
+    """Create the input backend called ``name`` ("pynput", "uinput" or "recording")"""
+    try:
+        backend = BACKENDS[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown input backend '{name}' (choose from {', '.join(BACKENDS)})"
+        ) from None
+    return backend(**options)
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""Measure how accurately and cheaply MacroRecorder.play_events fires events.
+
+Everything is played against the headless recording backend, so no display
+or input device is needed. Lateness is how long after its scheduled time
+(iteration start plus the event's ``time``) each event fired. The suite runs:
+
+- the bundled ``macros/*.json``, sped up by ``--speed``;
+- synthetic macros of ``--sizes`` events spaced ``--interval-us`` apart, for
+  lateness and CPU time per event, along with the cost of compiling them and
+  their memory as dicts and compiled;
+- the same macros with every event due at once, for raw dispatch throughput;
+- a short macro looped ``--loops`` times, reporting how late each iteration
+  started relative to ``epoch + k * duration`` (the last and the worst);
+- the cost of one ``move_mouse_smoothly`` call with the current settings.
+
+Smooth mouse movement and randomization are disabled for the timing runs.
+Exits with status 1 if ``--max-p99-ms`` is given and any run exceeds it.
+"""
+
+import argparse
+import contextlib
+import glob
+import json
+import os
+import sys
+import time
+import tracemalloc
+from array import array
+from pathlib import Path
+
+from macro_compiled import CompiledMacro
+from macro_recorder import MacroRecorder
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+MACRO_GLOB = str(SCRIPT_DIR / "macros" / "*.json")
+
+
+def synthetic_macro(count, interval):
+    """Alternating mouse clicks and key presses/releases, ``interval`` seconds apart"""
+    events = []
+    for i in range(count):
+        kind = i % 3
+        if kind == 0:
+            event = {
+                "type": "mouse",
+                "action": "click",
+                "x": i % 1920,
+                "y": i % 1080,
+                "button": "left",
+            }
+        else:
+            event = {
+                "type": "keyboard",
+                "action": "press" if kind == 1 else "release",
+                "key": "a",
+                "is_special": False,
+            }
+        event["time"] = i * interval
+        events.append(event)
+    return events
+
+
+def new_recorder():
+    recorder = MacroRecorder(backend="recording")
+    recorder.smooth_mouse["enabled"] = False
+    recorder.randomization["enabled"] = False
+    return recorder
+
+
+def play(recorder, events, iterations=1):
+    """Play ``events`` ``iterations`` times with output suppressed.
+
+    Returns:
+        dict: Wall and CPU seconds, the scheduler's lateness summary and how
+        late each iteration started, in nanoseconds
+    """
+
+    def executed(event_time):
+        if recorder.pause_state["iteration"] > iterations:
+            recorder.stop_playing()
+
+    recorder.on_event_executed = executed
+    recorder.pause_state.update({"current_index": 0, "iteration": 1})
+    recorder.state = "playing"
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        cpu = time.process_time()
+        wall = time.perf_counter()
+        recorder.play_events(events, loop=iterations > 1)
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+    recorder.state = "idle"
+
+    return {
+        "wall": wall,
+        "cpu": cpu,
+        "lateness": recorder.scheduler.summary(),
+        # Playback stops once the iteration after the last one has started
+        "iteration_lateness_ns": list(recorder.iteration_drift_ns)[:iterations],
+    }
+
+
+def timing_row(name, events, result):
+    """``events`` may be a list of event dicts or a CompiledMacro"""
+    lateness = result["lateness"]
+    return {
+        "run": name,
+        "events": len(events),
+        "p50_ms": lateness["p50_ms"],
+        "p99_ms": lateness["p99_ms"],
+        "max_ms": lateness["max_ms"],
+        "cpu_us_per_event": result["cpu"] / len(events) * 1e6,
+        "events_per_s": len(events) / result["wall"],
+    }
+
+
+def print_timing(row):
+    print(
+        f"{row['run']:<28} {row['events']:>8} {row['p50_ms']:>8.3f} "
+        f"{row['p99_ms']:>8.3f} {row['max_ms']:>8.3f} "
+        f"{row['cpu_us_per_event']:>9.1f} {row['events_per_s']:>11.0f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=100.0,
+        help="Play bundled macros this many times faster than recorded",
+    )
+    parser.add_argument(
+        "--sizes",
+        default="10000,100000",
+        help="Comma-separated synthetic macro sizes (e.g. 10000,100000,1000000)",
+    )
+    parser.add_argument(
+        "--interval-us",
+        type=float,
+        default=50.0,
+        help="Spacing of synthetic events in microseconds",
+    )
+    parser.add_argument(
+        "--loops", type=int, default=200, help="Iterations for the drift run"
+    )
+    parser.add_argument(
+        "--json", action="store_true", help="Print one JSON object per run"
+    )
+    parser.add_argument(
+        "--max-p99-ms",
+        type=float,
+        help="Fail if any timed run's p99 lateness exceeds this",
+    )
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+
+    recorder = new_recorder()
+    rows = []
+
+    def report(row):
+        rows.append(row)
+        if args.json:
+            print(json.dumps(row), flush=True)
+        elif "p50_ms" in row:
+            print_timing(row)
+
+    if not args.json:
+        print(
+            f"{'run':<28} {'events':>8} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} "
+            f"{'cpu us/ev':>9} {'events/s':>11}"
+        )
+
+    for path in sorted(glob.glob(MACRO_GLOB)):
+        with open(path, "r") as f:
+            events = recorder.normalize_macro(json.load(f))
+        for event in events:
+            event["time"] /= args.speed
+        report(timing_row(Path(path).name, events, play(recorder, events)))
+
+    for size in sizes:
+        tracemalloc.start()
+        events = synthetic_macro(size, args.interval_us / 1e6)
+        dict_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        start = time.perf_counter()
+        macro = CompiledMacro.compile(events, recorder.backend)
+        compile_seconds = time.perf_counter() - start
+        del events
+        report(
+            {
+                "run": f"synthetic {size} (compile)",
+                "events": size,
+                "compile_us_per_event": compile_seconds / size * 1e6,
+                "dict_bytes_per_event": dict_bytes / size,
+                "compiled_bytes_per_event": macro.nbytes() / size,
+            }
+        )
+
+        report(timing_row(f"synthetic {size}", macro, play(recorder, macro)))
+        # Everything due at once: measures dispatch cost, not timing
+        macro.times_ns = array("q", [0]) * size
+        result = play(recorder, macro)
+        row = timing_row(f"synthetic {size} (burst)", macro, result)
+        report(
+            {
+                "run": row["run"],
+                "events": size,
+                "cpu_us_per_event": row["cpu_us_per_event"],
+                "events_per_s": row["events_per_s"],
+            }
+        )
+        if not args.json:
+            print(
+                f"{row['run']:<28} {size:>8} {'-':>8} {'-':>8} {'-':>8} "
+                f"{row['cpu_us_per_event']:>9.1f} {row['events_per_s']:>11.0f}"
+            )
+            print(
+                f"{'':<28} compiled in {compile_seconds / size * 1e6:.1f}us/event: "
+                f"{macro.nbytes() / size:.0f} bytes/event vs "
+                f"{dict_bytes / size:.0f} as dicts"
+            )
+        del macro
+
+    # A 20ms macro looped: iterations are scheduled from one epoch, so their
+    # start lateness stays bounded instead of accumulating
+    events = synthetic_macro(20, 0.001)
+    events.append({"type": "delay", "time": 0.02})
+    duration = events[-1]["time"] - events[0]["time"]
+    lateness = play(recorder, events, iterations=args.loops)["iteration_lateness_ns"]
+    last_ms, max_ms = lateness[-1] / 1e6, max(lateness) / 1e6
+    report(
+        {
+            "run": "loop drift",
+            "iterations": len(lateness),
+            "duration_ms": duration * 1e3,
+            "last_iteration_lateness_ms": last_ms,
+            "max_iteration_lateness_ms": max_ms,
+        }
+    )
+    if not args.json:
+        print(
+            f"\nLoop drift: iterations of {duration * 1e3:.0f}ms started at most "
+            f"{max_ms:.3f}ms late over {len(lateness)} iterations "
+            f"(last {last_ms:.3f}ms)"
+        )
+
+    smooth = MacroRecorder(backend="recording")
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        cpu = time.process_time()
+        smooth.move_mouse_smoothly(0, 0, 1000, 500)
+        cpu = time.process_time() - cpu
+        elapsed = time.perf_counter() - start
+    report(
+        {
+            "run": "move_mouse_smoothly",
+            "steps": smooth.smooth_mouse["steps"],
+            "wall_ms": elapsed * 1e3,
+            "cpu_ms": cpu * 1e3,
+        }
+    )
+    if not args.json:
+        print(
+            f"move_mouse_smoothly: {elapsed * 1e3:.1f}ms wall, {cpu * 1e3:.1f}ms CPU "
+            f"for {smooth.smooth_mouse['steps']} steps"
+        )
+
+    if args.max_p99_ms is not None:
+        slow = [row["run"] for row in rows if row.get("p99_ms", 0) > args.max_p99_ms]
+        if slow:
+            print(f"\np99 lateness over {args.max_p99_ms}ms: {', '.join(slow)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
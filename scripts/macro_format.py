@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""Compact binary macro files that are memory-mapped and decoded lazily.
+
+Layout (little endian):
+
+- a 32 byte header: magic ``MACR``, format version, record size, event
+  count, string table offset and string count;
+- one fixed-width record per event: time (float64), type, action, flags,
+  x, y (int32) and the index of the event's button or key in the string
+  table;
+- the string table: every distinct button/key name as a uint32 length
+  followed by UTF-8 bytes.
+
+Opening a file only reads the header, so its size doesn't matter until
+events are touched; each event is decoded from the mapping when accessed.
+Times are stored as float64 like JSON numbers, so converting JSON -> binary
+-> JSON gives back exactly the same events.
+
+Usage:
+    ./macro_format.py to-binary macros/lumber-oak.json   # writes .macro
+    ./macro_format.py to-json macros/lumber-oak.macro    # writes .json
+"""
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+from collections.abc import Sequence
+
+BINARY_SUFFIX = ".macro"
+MAGIC = b"MACR"
+VERSION = 1
+HEADER = struct.Struct("<4sHHQQI4x")
+RECORD = struct.Struct("<dBBBxiiI")
+STRING_LENGTH = struct.Struct("<I")
+
+TYPES = ["mouse", "keyboard", "delay"]
+ACTIONS = [None, "click", "press", "release"]
+FLAG_SPECIAL = 1
+INT32_RANGE = range(-(2**31), 2**31)
+
+# Fields of each event type, in the order the recorder writes them
+FIELDS = {
+    "mouse": ["type", "action", "x", "y", "button", "time"],
+    "keyboard": ["type", "action", "key", "is_special", "time"],
+    "delay": ["type", "time"],
+}
+
+
+def _encode_event(event, strings):
+    """Pack one event dict, adding its button/key name to ``strings``"""
+    event_type = event.get("type")
+    if event_type not in FIELDS or set(event) != set(FIELDS[event_type]):
+        raise ValueError(f"Event can't be stored in the binary format: {event}")
+
+    action = ACTIONS.index(event["action"]) if "action" in event else 0
+    name = event.get("button", event.get("key"))
+    index = strings.setdefault(name, len(strings)) if name is not None else 0
+    x, y = event.get("x", 0), event.get("y", 0)
+    if (
+        type(x) is not int
+        or type(y) is not int
+        or x not in INT32_RANGE
+        or (y not in INT32_RANGE)
+    ):
+        raise ValueError(f"Mouse position must be 32-bit integers: {event}")
+    flags = FLAG_SPECIAL if event.get("is_special") else 0
+    return RECORD.pack(
+        float(event["time"]), TYPES.index(event_type), action, flags, x, y, index
+    )
+
+
+def write_macro(path, events):
+    """Write events (dicts as recorded) to a binary macro file, atomically"""
+    strings = {}
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(bytes(HEADER.size))
+        count = 0
+        for event in events:
+            f.write(_encode_event(event, strings))
+            count += 1
+        strings_offset = f.tell()
+        for name in strings:
+            data = name.encode("utf-8")
+            f.write(STRING_LENGTH.pack(len(data)) + data)
+        f.seek(0)
+        f.write(
+            HEADER.pack(
+                MAGIC, VERSION, RECORD.size, count, strings_offset, len(strings)
+            )
+        )
+    os.replace(tmp_path, path)
+
+
+class MacroFile(Sequence):
+    """A binary macro file as a read-only sequence of event dicts.
+
+    The file is memory-mapped; events are decoded each time they are
+    accessed and the string table on first use. ``copy()`` returns a plain
+    list, like ``list.copy()``, for code that edits the events.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < HEADER.size:
+                raise ValueError(f"{path} is too short for a macro file")
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._read_header(path, size)
+        except ValueError:
+            self._map.close()
+            raise
+        self._strings = None
+
+    def _read_header(self, path, size):
+        magic, version, record_size, count, strings_offset, string_count = (
+            HEADER.unpack_from(self._map)
+        )
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a binary macro file")
+        if version != VERSION or record_size != RECORD.size:
+            raise ValueError(f"{path} uses unsupported macro format {version}")
+        if HEADER.size + count * RECORD.size > strings_offset or strings_offset > size:
+            raise ValueError(f"{path} is truncated")
+        if string_count * STRING_LENGTH.size > size - strings_offset:
+            raise ValueError(f"{path} has a corrupt string table")
+
+        self._count = count
+        self._strings_offset = strings_offset
+        self._string_count = string_count
+
+    @property
+    def strings(self):
+        if self._strings is None:
+            strings = []
+            offset = self._strings_offset
+            size = len(self._map)
+            for _ in range(self._string_count):
+                if offset + STRING_LENGTH.size > size:
+                    raise ValueError(f"{self.path} has a corrupt string table")
+                (length,) = STRING_LENGTH.unpack_from(self._map, offset)
+                offset += STRING_LENGTH.size
+                if offset + length > size:
+                    raise ValueError(f"{self.path} has a corrupt string table")
+                try:
+                    strings.append(self._map[offset : offset + length].decode("utf-8"))
+                except UnicodeDecodeError:
+                    raise ValueError(
+                        f"{self.path} has a corrupt string table"
+                    ) from None
+                offset += length
+            self._strings = strings
+        return self._strings
+
+    def __len__(self):
+        return self._count
+
+    def _decode(self, record):
+        time, type_index, action, flags, x, y, index = record
+        if (
+            type_index >= len(TYPES)
+            or action >= len(ACTIONS)
+            or (type_index != TYPES.index("delay") and index >= len(self.strings))
+        ):
+            raise ValueError(f"{self.path} has a corrupt event record")
+        event_type = TYPES[type_index]
+        if event_type == "mouse":
+            return {
+                "type": "mouse",
+                "action": ACTIONS[action],
+                "x": x,
+                "y": y,
+                "button": self.strings[index],
+                "time": time,
+            }
+        if event_type == "keyboard":
+            return {
+                "type": "keyboard",
+                "action": ACTIONS[action],
+                "key": self.strings[index],
+                "is_special": bool(flags & FLAG_SPECIAL),
+                "time": time,
+            }
+        return {"type": event_type, "time": time}
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("macro event index out of range")
+        return self._decode(
+            RECORD.unpack_from(self._map, HEADER.size + index * RECORD.size)
+        )
+
+    def records(self):
+        """Iterate over the raw record tuples, without building dicts"""
+        end = HEADER.size + self._count * RECORD.size
+        with memoryview(self._map) as view:
+            yield from RECORD.iter_unpack(view[HEADER.size : end])
+
+    def __iter__(self):
+        for record in self.records():
+            yield self._decode(record)
+
+    def copy(self):
+        return list(self)
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_events(path):
+    """Events of a JSON or binary macro file (a list, or a lazy MacroFile)"""
+    if path.endswith(BINARY_SUFFIX):
+        return MacroFile(path)
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def write_events(path, events):
+    """Save events as binary or indented JSON, depending on the file suffix"""
+    if path.endswith(BINARY_SUFFIX):
+        write_macro(path, events)
+    else:
+        with open(path, "w") as file:
+            json.dump(list(events), file, indent=4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=["to-binary", "to-json"])
+    parser.add_argument("files", nargs="+", metavar="file")
+    args = parser.parse_args()
+
+    suffix = BINARY_SUFFIX if args.command == "to-binary" else ".json"
+    for path in args.files:
+        output = os.path.splitext(path)[0] + suffix
+        events = read_events(path)
+        write_events(output, events)
+        print(f"{path} -> {output} ({len(events)} events)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,40 @@
-from pynput import mouse, keyboard
-from pynput.mouse import Button, Controller as MouseController
-from pynput.keyboard import Key, Controller as KeyboardController
 import time
 import json
 import os
 import random
+from array import array
+
+from macro_backends import SPECIAL_KEYS, InputBackend, create_backend
+from macro_compiled import (
+    OP_CLICK,
+    OP_DELAY,
+    OP_KEY_PRESS,
+    OP_KEY_RELEASE,
+    CompiledMacro,
+)
+from macro_format import BINARY_SUFFIX, MacroFile, write_events
+from macro_scheduler import HybridScheduler, PlaybackControl
+
+try:
+    from pynput import mouse, keyboard
+    from pynput.keyboard import Key
+except ImportError:
+    # Without pynput (or a display) only headless playback backends work
+    mouse = keyboard = Key = None
 
 
 class MacroRecorder:
-    def __init__(self):
+    def __init__(self, backend="pynput"):
+        """
+        backend: Where playback sends input, an InputBackend or the name of
+        one ("pynput", "uinput" or "recording")
+        """
         # Variables to store recorded events and timings
         self.events = []
-        self.state = "idle"  # Can be "idle", "recording", or "playing"
+        # Binary macros mapped by the last load_all_macros, closed on reload
+        self.macro_files = []
+        # Holds the state: "idle", "recording", "playing" or "paused"
+        self.playback = PlaybackControl()
         self.start_time = None
         self.last_recorded_time = None
         self.on_event_executed = None
@@ -29,6 +52,7 @@ class MacroRecorder:
             "position_jitter": 5,  # pixels
             "time_jitter_percent": 8,  # percentage of original delay
             "max_extra_delay": 0.5,  # maximum additional random delay
+            "loop_jitter": 0.0,  # maximum random delay of each loop start, seconds
         }
 
         self.pause_state = {
@@ -43,33 +67,39 @@ class MacroRecorder:
             "iteration_start_time": None,  # Add this to track iteration timing
         }
 
-        # Controllers
-        self.mouse_controller = MouseController()
-        self.keyboard_controller = KeyboardController()
+        # Lateness of the first event of every loop iteration, in nanoseconds
+        self.iteration_drift_ns = array("q")
+
+        # Schedules playback on a monotonic clock and records event lateness;
+        # its coarse sleeps end early when the state changes
+        self.scheduler = HybridScheduler(
+            sleep=lambda seconds: self.playback.wait_while("playing", seconds),
+            clock=self.playback.clock,
+        )
+
+        # Input backend used for playback
+        if not isinstance(backend, InputBackend):
+            backend = create_backend(backend)
+        self.backend = backend
 
         # Directory for macros
         self.MACRO_DIR = "macros"
         os.makedirs(self.MACRO_DIR, exist_ok=True)
 
         # Special keys mapping
-        self.special_keys = {
-            Key.enter: "enter",
-            Key.space: "space",
-            Key.backspace: "backspace",
-            Key.delete: "delete",
-            Key.tab: "tab",
-            Key.shift: "shift",
-            Key.ctrl: "ctrl",
-            Key.alt: "alt",
-            Key.caps_lock: "caps_lock",
-            Key.esc: "esc",
-            Key.up: "up",
-            Key.down: "down",
-            Key.left: "left",
-            Key.right: "right",
-        }
+        self.special_keys = (
+            {getattr(Key, name): name for name in SPECIAL_KEYS} if Key else {}
+        )
         self.special_keys_reverse = {v: k for k, v in self.special_keys.items()}
 
+    @property
+    def state(self):
+        return self.playback.state
+
+    @state.setter
+    def state(self, value):
+        self.playback.set_state(value)
+
     def normalize_macro(self, events):
         """
         Normalize a macro so that the first action starts at time 0
@@ -141,8 +171,7 @@ class MacroRecorder:
                 normalized_macro = self.normalize_macro(selected_macro)
                 # Save the normalized macro
                 filepath = os.path.join(self.MACRO_DIR, macro_name)
-                with open(filepath, "w") as file:
-                    json.dump(normalized_macro, file, indent=4)
+                write_events(filepath, normalized_macro)
                 print(f"Macro normalized and saved to {filepath}")
 
         except (IndexError, ValueError):
@@ -167,7 +196,10 @@ class MacroRecorder:
             f"5. Smooth Mouse Movement (Currently: {'Enabled' if self.smooth_mouse['enabled'] else 'Disabled'})"
         )
         print(f"6. Mouse Movement Steps (Currently: {self.smooth_mouse['steps']})")
-        print("7. Back to Main Menu")
+        print(
+            f"7. Loop Start Jitter (Currently: up to {self.randomization['loop_jitter']}s)"
+        )
+        print("8. Back to Main Menu")
 
         choice = input("Enter your choice: ").strip()
 
@@ -211,6 +243,13 @@ class MacroRecorder:
                     print("Steps must be between 10 and 50.")
             except ValueError:
                 print("Invalid input. Please enter a number.")
+        elif choice == "7":
+            try:
+                jitter = float(input("Enter maximum loop start jitter in seconds: "))
+                if jitter >= 0:
+                    self.randomization["loop_jitter"] = jitter
+            except ValueError:
+                print("Invalid input. Please enter a number.")
 
     def move_mouse_smoothly(self, start_x, start_y, end_x, end_y):
         """Move mouse smoothly from start position to end position"""
@@ -222,7 +261,7 @@ class MacroRecorder:
             t = i / steps
             current_x = int(start_x + (end_x - start_x) * t)
             current_y = int(start_y + (end_y - start_y) * t)
-            self.mouse_controller.position = (current_x, current_y)
+            self.backend.move_to(current_x, current_y)
             time.sleep(self.smooth_mouse["delay"])
 
     def apply_position_jitter(self, x, y):
@@ -249,12 +288,30 @@ class MacroRecorder:
 
         return max(delay, min(max_extra_delay, jittered_delay))
 
+    def loop_start_jitter(self):
+        """Random delay for the start of a loop iteration, in nanoseconds"""
+        if not self.randomization["enabled"]:
+            return 0
+        return int(random.uniform(0, self.randomization["loop_jitter"]) * 1e9)
+
     def load_all_macros(self):
-        """Load all macros with improved error handling"""
+        """Load all macros with improved error handling
+
+        Binary (.macro) files are only memory-mapped here; their events are
+        decoded when playback or editing touches them. The maps of the
+        previous call are closed, so its MacroFiles can no longer be read.
+        """
+        self.close_macros()
         macros = {}
         try:
             for file in os.listdir(self.MACRO_DIR):
-                if file.endswith(".json"):
+                if file.endswith(BINARY_SUFFIX):
+                    try:
+                        macros[file] = MacroFile(os.path.join(self.MACRO_DIR, file))
+                        self.macro_files.append(macros[file])
+                    except (OSError, ValueError) as e:
+                        print(f"Error loading macro {file}: {e}")
+                elif file.endswith(".json"):
                     filepath = os.path.join(self.MACRO_DIR, file)
                     try:
                         if os.path.getsize(filepath) > 0:  # Check if file is not empty
@@ -272,14 +329,20 @@ class MacroRecorder:
             print(f"Error accessing macro directory: {e}")
         return macros
 
+    def close_macros(self):
+        """Unmap the binary macros opened by load_all_macros"""
+        for macro_file in self.macro_files:
+            macro_file.close()
+        self.macro_files = []
+
     def save_macro(self, filename):
         if self.events and self.state == "recording":
             self.add_final_timing()
 
         filepath = os.path.join(self.MACRO_DIR, filename)
         try:
-            with open(filepath, "w") as file:
-                json.dump(self.events, file, indent=4)
+            # A ".macro" filename saves in the binary format
+            write_events(filepath, self.events)
             print(f"Macro saved to {filepath}")
         except Exception as e:
             print(f"Error saving macro: {e}")
@@ -373,123 +436,151 @@ class MacroRecorder:
         try:
             choice_idx = int(choice) - 1
             macro_name = list(macros.keys())[choice_idx]
-            selected_macro = macros[macro_name]
-
-            # Initialize pause state
-            self.state = "playing"
-            current_time = time.time()
-            self.pause_state.update(
-                {
-                    "enabled": False,  # Will be set to True when paused
-                    "current_index": 0,
-                    "macro_name": macro_name,
-                    "selected_macro": selected_macro,
-                    "iteration": 1,
-                    "loop": loop,
-                    "total_start_time": current_time,
-                    "iteration_start_time": current_time,
-                    "last_event_time": current_time,
-                }
-            )
-
-            self.play_events(selected_macro, loop)
         except (IndexError, ValueError):
             print("Invalid choice.")
+            return
+
+        selected_macro = macros[macro_name]
+        try:
+            # Resolving the keys fails for keys the backend can't send
+            compiled = CompiledMacro.compile(selected_macro, self.backend)
+        except ValueError as e:
+            print(f"Can't play {macro_name}: {e}")
+            return
+
+        # Initialize pause state
+        self.state = "playing"
+        current_time = time.time()
+        self.pause_state.update(
+            {
+                "enabled": False,  # Will be set to True when paused
+                "current_index": 0,
+                "macro_name": macro_name,
+                "selected_macro": selected_macro,
+                "iteration": 1,
+                "loop": loop,
+                "total_start_time": current_time,
+                "iteration_start_time": current_time,
+                "last_event_time": current_time,
+            }
+        )
+
+        self.play_events(compiled, loop)
+
+        timing = self.scheduler.summary()
+        if timing["events"]:
+            print(
+                f"Timing over {timing['events']} events: lateness "
+                f"p50 {timing['p50_ms']:.3f}ms, p99 {timing['p99_ms']:.3f}ms, "
+                f"max {timing['max_ms']:.3f}ms"
+            )
+        if len(self.iteration_drift_ns) > 1:
+            print(
+                f"Loop drift over {len(self.iteration_drift_ns)} iterations: "
+                f"last {self.iteration_drift_ns[-1] / 1e6:.3f}ms, "
+                f"max {max(self.iteration_drift_ns) / 1e6:.3f}ms"
+            )
 
     def play_events(self, selected_macro, loop=False):
-        """Play recorded events with precise timing and reliable pause/resume."""
+        """Play recorded events with precise timing and reliable pause/resume.
+
+        selected_macro: A list of event dicts, or a CompiledMacro compiled for
+        this recorder's backend (to skip compiling on every call)
+        """
         if not selected_macro:
             print("No events recorded!")
             return
 
+        # Compiled once, so iterations don't copy or re-parse the events
+        macro = selected_macro
+        if not isinstance(macro, CompiledMacro):
+            macro = CompiledMacro.compile(selected_macro, self.backend)
+        times_ns, opcodes = macro.times_ns, macro.opcodes
+        xs, ys, inputs = macro.xs, macro.ys, macro.inputs
+        resolved, names = macro.resolved, macro.names
+        count = len(macro)
+        backend = self.backend
+
+        scheduler = self.scheduler
+        scheduler.reset()
+        clock = scheduler.clock
+        self.iteration_drift_ns = array("q")
+
+        playback = self.playback
+
+        def interrupted():
+            return playback.state != "playing"
+
+        # Iteration k is anchored at epoch + k * duration (nanoseconds on the
+        # scheduler's monotonic clock), so lateness never carries over
+        epoch = clock()
+        duration = macro.duration_ns
+        iteration_start = epoch
+        completed = 0
+
         while True:
-            iteration_start = time.time()
-            events = selected_macro.copy()
             i = self.pause_state["current_index"]
 
-            while i < len(events):
-                event = events[i]
-                target_time = event["time"]
-
-                # Calculate when this event should occur relative to iteration start
-                target_absolute_time = iteration_start + target_time
-
-                # Wait and handle pause states
-                while time.time() < target_absolute_time:
-                    if self.state != "playing":
-                        if self.state == "paused":
-                            # Store the time we paused at
-                            pause_time = time.time()
-                            self.pause_state["enabled"] = True
-                            self.pause_state["current_index"] = i
-
-                            while self.state == "paused":
-                                time.sleep(0.01)
-
-                            if self.state != "playing":
-                                return
+            while i < count:
+                # Sleep until just before the event, then spin to it
+                lateness = scheduler.wait_until(
+                    iteration_start + times_ns[i], interrupted
+                )
+                if lateness is None:
+                    if self.state != "paused":  # state is "idle" (stopped)
+                        return
 
-                            # Adjust iteration_start by the duration we were paused
-                            pause_duration = time.time() - pause_time
-                            iteration_start += pause_duration
-                            break  # Recalculate target_absolute_time
-                        else:  # state is "idle" (stopped)
-                            return
-                    time.sleep(0.001)
+                    self.pause_state["enabled"] = True
+                    self.pause_state["current_index"] = i
 
-                # Recalculate target time after potential pause
-                target_absolute_time = iteration_start + target_time
+                    # Sleeps until resumed or stopped
+                    if self.playback.wait_while("paused") != "playing":
+                        return
 
-                # Final state check before executing
-                if self.state != "playing":
-                    continue
+                    # Shift the schedule by the duration we were paused
+                    if self.playback.pauses_ns:
+                        iteration_start += self.playback.pauses_ns[-1]
+                        epoch += self.playback.pauses_ns[-1]
+                    continue  # Wait for the event again
 
-                # Wait for any remaining time
-                current_time = time.time()
-                if current_time < target_absolute_time:
-                    time.sleep(target_absolute_time - current_time)
+                if i == 0:
+                    self.iteration_drift_ns.append(lateness)
 
                 # Notify about current event time
                 if self.on_event_executed:
-                    self.on_event_executed(target_time)
+                    self.on_event_executed(times_ns[i] / 1e9)
 
                 # Execute the event
-                elapsed = time.time() - iteration_start
-                if event["type"] == "mouse":
-                    current_pos = self.mouse_controller.position
-                    jittered_x, jittered_y = self.apply_position_jitter(
-                        event["x"], event["y"]
-                    )
+                elapsed = (clock() - iteration_start) / 1e9
+                opcode = opcodes[i]
+                if opcode == OP_CLICK:
+                    current_pos = backend.position
+                    jittered_x, jittered_y = self.apply_position_jitter(xs[i], ys[i])
 
                     if self.smooth_mouse["enabled"]:
                         self.move_mouse_smoothly(
                             current_pos[0], current_pos[1], jittered_x, jittered_y
                         )
                     else:
-                        self.mouse_controller.position = (jittered_x, jittered_y)
+                        backend.move_to(jittered_x, jittered_y)
 
-                    button = Button.left if event["button"] == "left" else Button.right
+                    button = resolved[inputs[i]]
                     print(
-                        f"[{elapsed:.2f}s] Mouse click: {button.name} at ({jittered_x}, {jittered_y})"
+                        f"[{elapsed:.2f}s] Mouse click: {names[inputs[i]]} at ({jittered_x}, {jittered_y})"
                     )
 
-                    self.mouse_controller.press(button)
-                    self.mouse_controller.release(button)
+                    backend.press_button(button)
+                    backend.release_button(button)
 
-                elif event["type"] == "keyboard":
-                    if event["is_special"]:
-                        key = self.special_keys_reverse.get(event["key"])
-                    else:
-                        key = event["key"]
+                elif opcode == OP_KEY_PRESS:
+                    print(f"[{elapsed:.2f}s] Key press: {names[inputs[i]]}")
+                    backend.press_key(resolved[inputs[i]])
 
-                    if event["action"] == "press":
-                        print(f"[{elapsed:.2f}s] Key press: {key}")
-                        self.keyboard_controller.press(key)
-                    else:
-                        print(f"[{elapsed:.2f}s] Key release: {key}")
-                        self.keyboard_controller.release(key)
+                elif opcode == OP_KEY_RELEASE:
+                    print(f"[{elapsed:.2f}s] Key release: {names[inputs[i]]}")
+                    backend.release_key(resolved[inputs[i]])
 
-                elif event["type"] == "delay":
+                elif opcode == OP_DELAY:
                     print(f"[{elapsed:.2f}s] Delay")
 
                 # Increment index after successful execution
@@ -508,22 +599,21 @@ class MacroRecorder:
                     "iteration_start_time": time.time(),
                 }
             )
+            completed += 1
+            iteration_start = epoch + completed * duration + self.loop_start_jitter()
 
     def pause_playback(self):
         """Pause playback without executing any additional events."""
-        if self.state == "playing":
-            self.state = "paused"
+        if self.playback.transition(("playing",), "paused"):
             print("\nPlayback paused. Press SPACE to resume or ESC to stop.")
 
     def resume_playback(self):
         """Resume playback from exactly where it was paused."""
-        if self.state == "paused":
-            self.state = "playing"
+        if self.playback.transition(("paused",), "playing"):
             print("\nPlayback resumed...")
 
     def stop_playing(self):
-        if self.state in ["playing", "paused"]:
-            self.state = "idle"
+        if self.playback.transition(("playing", "paused"), "idle"):
             self.pause_state["enabled"] = False
             print("Playback stopped.")
 
@@ -592,8 +682,7 @@ def main():
 
             if choice == "1":
                 recorder.start_recording()
-                while recorder.state == "recording":
-                    time.sleep(0.1)
+                recorder.playback.wait_while("recording")
                 continue
 
             elif choice == "2":
@@ -603,10 +692,12 @@ def main():
                 macros = recorder.load_all_macros()
                 recorder.play_macro(macros, loop=True)
             elif choice == "4":
-                filename = (
-                    input("Enter filename for the macro (without extension): ").strip()
-                    + ".json"
-                )
+                filename = input(
+                    "Enter filename for the macro (.json unless it ends in "
+                    f"{BINARY_SUFFIX}): "
+                ).strip()
+                if not filename.endswith((".json", BINARY_SUFFIX)):
+                    filename += ".json"
                 recorder.save_macro(filename)
             elif choice == "5":
                 macros = recorder.load_all_macros()
@@ -617,6 +708,7 @@ def main():
                 mouse_listener.stop()
                 recorder.stop_playing()
                 key_listener.stop()
+                recorder.close_macros()
                 break
             else:
                 print("Invalid choice!")
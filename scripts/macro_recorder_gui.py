@@ -439,7 +439,11 @@ class PlaybackThread(QThread):
         self.progress.emit(event_time)
 
     def run(self):
-        self.macro_recorder.play_events(self.macro_events, self.loop)
+        try:
+            self.macro_recorder.play_events(self.macro_events, self.loop)
+        except ValueError as e:
+            # A key the input backend can't send
+            print(f"Can't play macro: {e}")
         self.finished.emit()
 
 
@@ -619,6 +623,7 @@ class MacroRecorderGUI(QMainWindow):
         self.macro_recorder.stop_playing()
         if self.playback_thread and self.playback_thread.isRunning():
             self.playback_thread.wait()
+        self.macro_recorder.close_macros()
         event.accept()
 
     def init_ui(self):
@@ -980,6 +985,8 @@ class MacroRecorderGUI(QMainWindow):
         if reply == QMessageBox.Yes:
             try:
                 filepath = os.path.join(self.macro_recorder.MACRO_DIR, macro_name)
+                # A deleted file's disk space is only freed once it is unmapped
+                self.macro_recorder.close_macros()
                 os.remove(filepath)
                 self.refresh_macro_list()
                 self.timeline.set_events([])  # Clear timeline
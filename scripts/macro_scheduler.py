@@ -0,0 +1,151 @@
+import threading
+import time
+from array import array
+
+# Bounds for the spin window that follows the coarse sleep
+MIN_SPIN_NS = 50_000
+MAX_SPIN_NS = 2_000_000
+# Longest single sleep, so interruptions are noticed while waiting for far-off events
+MAX_SLEEP_NS = 20_000_000
+
+
+class HybridScheduler:
+    """Wait for monotonic deadlines by sleeping most of the way and spinning the rest.
+
+    ``time.sleep`` overshoots by tens to hundreds of microseconds depending on
+    the kernel and load, so it is only used until the deadline is one spin
+    window away. The window is calibrated from the measured sleep overshoot.
+    The remainder is spent polling ``perf_counter_ns``, which costs CPU only
+    for that short window instead of for the whole wait.
+
+    The lateness of every deadline (time it was actually reached minus the
+    deadline) is recorded in ``lateness_ns``.
+    """
+
+    def __init__(self, spin_ns=None, sleep=time.sleep, clock=time.perf_counter_ns):
+        self.clock = clock
+        self.sleep = sleep
+        self.spin_ns = spin_ns
+        self.lateness_ns = array("q")
+
+    def calibrate(self, samples=20, interval=0.001):
+        """Set the spin window from how far short sleeps overshoot on this machine"""
+        overshoots = []
+        for _ in range(samples):
+            start = self.clock()
+            time.sleep(interval)
+            overshoots.append(self.clock() - start - int(interval * 1e9))
+        overshoots.sort()
+        # 90th percentile plus a margin; the worst sample is usually noise
+        worst = overshoots[int(len(overshoots) * 0.9)]
+        self.spin_ns = max(MIN_SPIN_NS, min(MAX_SPIN_NS, int(worst * 1.5)))
+        return self.spin_ns
+
+    def reset(self):
+        """Forget recorded lateness before a new playback, calibrating if needed"""
+        self.lateness_ns = array("q")
+        if self.spin_ns is None:
+            self.calibrate()
+
+    def wait_until(self, deadline_ns, interrupted=None):
+        """Block until ``clock()`` reaches ``deadline_ns``.
+
+        ``interrupted`` is checked before every coarse sleep; once it returns
+        True the wait is abandoned.
+
+        Returns:
+            int: Nanoseconds the deadline was overshot by, or None if interrupted
+        """
+        if self.spin_ns is None:
+            self.calibrate()
+
+        clock = self.clock
+        while True:
+            if interrupted is not None and interrupted():
+                return None
+            remaining = deadline_ns - clock()
+            if remaining <= self.spin_ns:
+                break
+            self.sleep(min(remaining - self.spin_ns, MAX_SLEEP_NS) / 1e9)
+
+        now = clock()
+        while now < deadline_ns:
+            now = clock()
+
+        lateness = now - deadline_ns
+        self.lateness_ns.append(lateness)
+        return lateness
+
+    def summary(self):
+        """Lateness statistics of the recorded deadlines, in milliseconds"""
+        if not self.lateness_ns:
+            return {"events": 0, "p50_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+        ordered = sorted(self.lateness_ns)
+        last = len(ordered) - 1
+        return {
+            "events": len(ordered),
+            "p50_ms": ordered[last // 2] / 1e6,
+            "p99_ms": ordered[last * 99 // 100] / 1e6,
+            "max_ms": ordered[-1] / 1e6,
+        }
+
+
+class PlaybackControl:
+    """Thread-safe recorder state that wakes waiting playback as soon as it changes.
+
+    The state is "idle", "recording", "playing" or "paused". Listener threads
+    and the GUI change it; the playback thread blocks in ``wait_while`` instead
+    of polling, so a resume or stop takes effect immediately and a long pause
+    costs no wakeups. The duration of every completed pause is recorded in
+    ``pauses_ns``.
+    """
+
+    def __init__(self, state="idle", clock=time.perf_counter_ns):
+        self.clock = clock
+        self._state = state
+        self._changed = threading.Condition()
+        self._paused_at = None
+        self.pauses_ns = array("q")
+
+    @property
+    def state(self):
+        return self._state
+
+    def set_state(self, state):
+        """Switch to ``state`` and wake everything waiting on the old one"""
+        with self._changed:
+            self._set(state)
+
+    def transition(self, from_states, state):
+        """Switch to ``state`` only if the current state is one of ``from_states``
+
+        Returns:
+            bool: Whether the state was changed
+        """
+        with self._changed:
+            if self._state not in from_states:
+                return False
+            self._set(state)
+            return True
+
+    def _set(self, state):
+        if state == self._state:
+            return
+        now = self.clock()
+        if state == "paused":
+            self._paused_at = now
+        elif self._paused_at is not None:
+            self.pauses_ns.append(now - self._paused_at)
+            self._paused_at = None
+        self._state = state
+        self._changed.notify_all()
+
+    def wait_while(self, state, timeout=None):
+        """Block while the state is ``state``, for at most ``timeout`` seconds
+
+        Returns:
+            str: The state when the wait ended
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self._state != state, timeout)
+            return self._state